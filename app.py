@@ -1,17 +1,33 @@
-from flask import Flask, request, jsonify, render_template, session as flask_session
+from flask import Flask, request, jsonify, render_template, session as flask_session, Response, stream_with_context, g
 from flask_cors import CORS
 from flask_sqlalchemy import SQLAlchemy
-from sqlalchemy.orm import DeclarativeBase
-from sqlalchemy import Column, Integer, String, Float, DateTime, Boolean, Text, Index, func, distinct, inspect
+from sqlalchemy.orm import DeclarativeBase, Session, aliased
+from sqlalchemy import Column, Integer, String, Float, DateTime, Boolean, Text, Index, func, distinct, inspect, text, or_, and_, event, update, select, delete, literal, cast, case
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.dialects.postgresql import insert as postgresql_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
 from datetime import datetime, timedelta
 import hashlib
 import secrets
 import random
 import os
 import json
+from collections import OrderedDict, Counter
+import threading
+import time
+import atexit
+import tempfile
+import queue
+import socket
+import ipaddress
 from dotenv import load_dotenv
 from flask_limiter import Limiter
 from flask_limiter.util import get_remote_address
+from limits.storage import Storage
+import sqlite3
+from math import floor, ceil
+from werkzeug.test import EnvironBuilder
+import click
 
 # Load environment variables
 load_dotenv()
@@ -43,12 +59,158 @@ app.config['PERMANENT_SESSION_LIFETIME'] = timedelta(hours=1)
 db.init_app(app)
 CORS(app)
 
-# Rate limiting
+# ==================== RATE LIMIT STORAGE ====================
+
+try:
+    from limits.storage.base import SlidingWindowCounterSupport
+except ImportError:
+    # limits < 4.1 has no sliding-window-counter strategy
+    class SlidingWindowCounterSupport:
+        pass
+
+class SQLiteLimiterStorage(Storage, SlidingWindowCounterSupport):
+    """Rate limit counters in a local SQLite file shared by every worker on the box.
+    
+    Registered for sqlite:/// URIs (same path rules as SQLAlchemy). Every
+    fixed-window hit is one upsert statement and every sliding-window hit
+    one IMMEDIATE transaction, so concurrent workers never lose counts; WAL
+    mode keeps a check well under a millisecond.
+    """
+    
+    STORAGE_SCHEME = ['sqlite']
+    PURGE_EVERY = 1000
+    
+    def __init__(self, uri, **options):
+        options.pop('wrap_exceptions', None)
+        super().__init__(uri)
+        path = uri.split('://', 1)[1]
+        self.path = path[1:] if path.startswith('/') else path
+        self._local = threading.local()
+        self._hits = 0
+    
+    @property
+    def base_exceptions(self):
+        return sqlite3.Error
+    
+    def _connection(self):
+        # sqlite3 connections can't cross threads or forks
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None, check_same_thread=False)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            conn.execute(
+                'CREATE TABLE IF NOT EXISTS rate_limits '
+                '(key TEXT PRIMARY KEY, value INTEGER NOT NULL, expires_at REAL NOT NULL) WITHOUT ROWID'
+            )
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+    
+    def _incr(self, conn, key, expiry, amount, elastic_expiry=False):
+        now = time.time()
+        # SET expressions all see the old row, so an expired window restarts at amount
+        value = conn.execute("""
+            INSERT INTO rate_limits (key, value, expires_at) VALUES (?, ?, ?)
+            ON CONFLICT(key) DO UPDATE SET
+                value = CASE WHEN expires_at <= ? THEN excluded.value ELSE value + excluded.value END,
+                expires_at = CASE WHEN expires_at <= ? OR ? THEN excluded.expires_at ELSE expires_at END
+            RETURNING value
+        """, (key, amount, now + expiry, now, now, int(bool(elastic_expiry)))).fetchone()[0]
+        
+        self._hits += 1
+        if self._hits % self.PURGE_EVERY == 0:
+            conn.execute('DELETE FROM rate_limits WHERE expires_at <= ?', (now,))
+        return value
+    
+    def incr(self, key, expiry, elastic_expiry=False, amount=1):
+        # elastic_expiry is only passed by limits < 4
+        return self._incr(self._connection(), key, expiry, amount, elastic_expiry)
+    
+    def _get(self, conn, key, now):
+        row = conn.execute(
+            'SELECT value FROM rate_limits WHERE key = ? AND expires_at > ?', (key, now)
+        ).fetchone()
+        return row[0] if row else 0
+    
+    def get(self, key):
+        return self._get(self._connection(), key, time.time())
+    
+    def get_expiry(self, key):
+        now = time.time()
+        row = self._connection().execute(
+            'SELECT expires_at FROM rate_limits WHERE key = ? AND expires_at > ?', (key, now)
+        ).fetchone()
+        return row[0] if row else now
+    
+    def check(self):
+        try:
+            self._connection().execute('SELECT 1')
+            return True
+        except sqlite3.Error:
+            return False
+    
+    def reset(self):
+        return self._connection().execute('DELETE FROM rate_limits').rowcount
+    
+    def clear(self, key):
+        self._connection().execute('DELETE FROM rate_limits WHERE key = ?', (key,))
+    
+    def _window_keys(self, key, expiry, now):
+        window = int(now // expiry)
+        return f'{key}/{window - 1}', f'{key}/{window}'
+    
+    def _sliding_window(self, conn, key, expiry, now):
+        previous_key, current_key = self._window_keys(key, expiry, now)
+        previous_count = self._get(conn, previous_key, now)
+        current_count = self._get(conn, current_key, now)
+        elapsed = now % expiry
+        previous_ttl = float(expiry - elapsed) if previous_count else 0.0
+        return previous_count, previous_ttl, current_count, float(2 * expiry - elapsed)
+    
+    def get_sliding_window(self, key, expiry):
+        return self._sliding_window(self._connection(), key, expiry, time.time())
+    
+    def acquire_sliding_window_entry(self, key, limit, expiry, amount=1):
+        if amount > limit:
+            return False
+        
+        conn = self._connection()
+        now = time.time()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            previous_count, previous_ttl, current_count, _ = self._sliding_window(conn, key, expiry, now)
+            if floor(previous_count * previous_ttl / expiry + current_count) + amount > limit:
+                conn.execute('ROLLBACK')
+                return False
+            self._incr(conn, self._window_keys(key, expiry, now)[1], 2 * expiry, amount)
+            conn.execute('COMMIT')
+            return True
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+    
+    def clear_sliding_window(self, key, expiry):
+        conn = self._connection()
+        for window_key in self._window_keys(key, expiry, time.time()):
+            conn.execute('DELETE FROM rate_limits WHERE key = ?', (window_key,))
+
+# Rate limiting: counters shared by all workers through a SQLite file by
+# default; point RATELIMIT_STORAGE_URI at redis://host:6379 (needs the redis
+# package) to share them across machines
+RATELIMIT_STORAGE_URI = os.getenv(
+    'RATELIMIT_STORAGE_URI',
+    'sqlite:///' + os.path.join(tempfile.gettempdir(), 'taskapro-ratelimits.db')
+)
+RATELIMIT_STRATEGY = os.getenv('RATELIMIT_STRATEGY', 'fixed-window')
+
 limiter = Limiter(
     get_remote_address,
     app=app,
     default_limits=["200 per day", "50 per hour"],
-    storage_uri="memory://",
+    storage_uri=RATELIMIT_STORAGE_URI,
+    strategy=RATELIMIT_STRATEGY,
+    in_memory_fallback_enabled=True,
 )
 
 # Environment variables
@@ -57,14 +219,42 @@ ADMIN_API_KEY = os.getenv('ADMIN_API_KEY', 'admin123')
 MAX_WALLETS_PER_IP = int(os.getenv('MAX_WALLETS_PER_IP', 5))
 IP_BAN_HOURS = int(os.getenv('IP_BAN_HOURS', 24))
 PRESALE_WALLET = os.getenv('PRESALE_WALLET', '0xa84e6D0Fa3B35b18FF7C65568C711A85Ac1A9FC7')
+LEADERBOARD_REFRESH_SECONDS = int(os.getenv('LEADERBOARD_REFRESH_SECONDS', 30))
+TASK_CATALOG_CHECK_SECONDS = int(os.getenv('TASK_CATALOG_CHECK_SECONDS', 30))
+TASK_STATE_CACHE_SECONDS = int(os.getenv('TASK_STATE_CACHE_SECONDS', 15))
+NOTIFICATION_FLUSH_SIZE = int(os.getenv('NOTIFICATION_FLUSH_SIZE', 100))
+NOTIFICATION_FLUSH_SECONDS = float(os.getenv('NOTIFICATION_FLUSH_SECONDS', 1))
+# Must survive restarts and redeploys (a persistent disk). Unset, notifications
+# are inserted in the request's transaction and link clicks are counted in memory
+SPOOL_DIR = os.getenv('SPOOL_DIR')
+EVENT_SOCKET_DIR = os.getenv('EVENT_SOCKET_DIR', os.path.join(tempfile.gettempdir(), 'taskapro-events'))
+SSE_KEEPALIVE_SECONDS = int(os.getenv('SSE_KEEPALIVE_SECONDS', 10))
+SSE_MAX_SECONDS = int(os.getenv('SSE_MAX_SECONDS', 30))
+# on / off / auto: auto streams /api/events only in gunicorn gevent workers, where
+# an open stream costs a greenlet rather than a worker thread; otherwise it answers 204
+LIVE_EVENTS_STREAMING = os.getenv('LIVE_EVENTS_STREAMING', 'auto')
+IP_RESTRICTION_CACHE_SECONDS = int(os.getenv('IP_RESTRICTION_CACHE_SECONDS', 30))
+IP_RESTRICTION_CACHE_SIZE = int(os.getenv('IP_RESTRICTION_CACHE_SIZE', 10000))
+IP_RANGE_CHECK_SECONDS = int(os.getenv('IP_RANGE_CHECK_SECONDS', 10))
+# Wallets allowed per IPv4 /24 or IPv6 /64 before the whole prefix is banned; 0 disables
+IP_PREFIX_MAX_WALLETS = int(os.getenv('IP_PREFIX_MAX_WALLETS', 0))
+TOKEN_BUCKET_MAX_KEYS = int(os.getenv('TOKEN_BUCKET_MAX_KEYS', 100000))
+# auto: initialize when the schema stamp is stale; verify: only check the stamp; skip: no DB work at import
+DB_INIT_MODE = os.getenv('DB_INIT_MODE', 'auto')
+# inline: claims update the referrer's counters directly; deferred: claims append
+# referral_events and a background fold applies them every REFERRAL_FOLD_SECONDS
+REFERRAL_COUNTER_MODE = os.getenv('REFERRAL_COUNTER_MODE', 'inline')
+REFERRAL_FOLD_SECONDS = float(os.getenv('REFERRAL_FOLD_SECONDS', 1))
+LINK_CLICK_FLUSH_SECONDS = float(os.getenv('LINK_CLICK_FLUSH_SECONDS', 1))
 
 # Achievement definitions
+# Each achievement unlocks once ACHIEVEMENT_METRICS[metric] reaches threshold
 ACHIEVEMENTS = [
-    {"id": "first_claim", "name": "Airdrop Pioneer", "icon": "🚀", "requirement": 0, "reward": 1},
-    {"id": "first_ref", "name": "First Referral", "icon": "🥇", "requirement": 1, "reward": 11},
-    {"id": "active_network", "name": "Network Builder", "icon": "🌐", "requirement": 3, "reward": 111},
-    {"id": "five_ref", "name": "Referral Master", "icon": "🏆", "requirement": 5, "reward": 1111},
-    {"id": "withdrawal_ready", "name": "Ready to Cash Out", "icon": "💰", "requirement": 6, "reward": 11111}
+    {"id": "first_claim", "name": "Airdrop Pioneer", "icon": "🚀", "requirement": 0, "reward": 1, "metric": "claims", "threshold": 1},
+    {"id": "first_ref", "name": "First Referral", "icon": "🥇", "requirement": 1, "reward": 11, "metric": "referrals", "threshold": 1},
+    {"id": "active_network", "name": "Network Builder", "icon": "🌐", "requirement": 3, "reward": 111, "metric": "referrals", "threshold": 3},
+    {"id": "five_ref", "name": "Referral Master", "icon": "🏆", "requirement": 5, "reward": 1111, "metric": "referrals", "threshold": 5},
+    {"id": "withdrawal_ready", "name": "Ready to Cash Out", "icon": "💰", "requirement": 6, "reward": 11111, "metric": "referrals", "threshold": 6}
 ]
 
 # Task definitions
@@ -261,10 +451,14 @@ class User(db.Model):
     active = Column(Boolean, default=False, nullable=False)
     ip_address = Column(String(45), nullable=True)
     last_active = Column(DateTime, default=datetime.utcnow, nullable=False)
+    # Direct referees that have an AirdropClaim, maintained in claim_airdrop
+    active_referral_count = Column(Integer, default=0, server_default=text('0'), nullable=False)
     
     __table_args__ = (
         Index('idx_user_referrer', 'referrer'),
         Index('idx_user_created_at', 'created_at'),
+        # Matches the leaderboard order so top-N and rank lookups are index scans
+        Index('idx_user_leaderboard', text('referral_count DESC'), 'created_at', 'wallet'),
     )
     
     def to_dict(self):
@@ -278,7 +472,8 @@ class User(db.Model):
             'referrer': self.referrer,
             'active': self.active,
             'ip_address': self.ip_address,
-            'last_active': self.last_active.isoformat()
+            'last_active': self.last_active.isoformat(),
+            'active_referral_count': self.active_referral_count
         }
 
 class AirdropClaim(db.Model):
@@ -295,10 +490,17 @@ class AirdropClaim(db.Model):
     tx_hash = Column(String(66), unique=True, nullable=False)
     claimed_at = Column(DateTime, default=datetime.utcnow, nullable=False)
     status = Column(String(20), default='completed', nullable=False)
+    # One of REWARD_TYPES ('duplicate' for double claims retired by upgrade_schema);
+    # every credit to a wallet is a row in this ledger
+    reward_type = Column(String(20), default='airdrop', server_default='airdrop', nullable=False)
     
     __table_args__ = (
         Index('idx_claim_claimed_at', 'claimed_at'),
         Index('idx_claim_wallet_status', 'wallet', 'status'),
+        Index('idx_claim_wallet_reward_type', 'wallet', 'reward_type'),
+        # At most one airdrop per wallet; concurrent claims conflict here instead of double-paying
+        Index('uq_claim_wallet_airdrop', 'wallet', unique=True,
+              postgresql_where=text("reward_type = 'airdrop'"), sqlite_where=text("reward_type = 'airdrop'")),
     )
     
     def to_dict(self):
@@ -311,7 +513,8 @@ class AirdropClaim(db.Model):
             'referrer': self.referrer,
             'tx_hash': self.tx_hash,
             'claimed_at': self.claimed_at.isoformat(),
-            'status': self.status
+            'status': self.status,
+            'reward_type': self.reward_type
         }
 
 class Referral(db.Model):
@@ -328,6 +531,15 @@ class Referral(db.Model):
         Index('idx_referral_code_used', 'code_used'),
     )
 
+class ReferralEvent(db.Model):
+    __tablename__ = 'referral_events'
+    
+    # Referrals not yet folded into users/referral_networks (REFERRAL_COUNTER_MODE=deferred)
+    id = Column(Integer, primary_key=True)
+    referrer = Column(String(42), nullable=False)
+    referee = Column(String(42), nullable=False)
+    created_at = Column(DateTime, default=datetime.utcnow, nullable=False)
+
 class Achievement(db.Model):
     __tablename__ = 'achievements'
     
@@ -353,8 +565,16 @@ class Notification(db.Model):
     __table_args__ = (
         Index('idx_notification_wallet_read', 'wallet', 'read'),
         Index('idx_notification_timestamp', 'timestamp'),
+        Index('idx_notification_wallet_timestamp_id', 'wallet', 'timestamp', 'id'),
     )
 
+class NotificationCounter(db.Model):
+    __tablename__ = 'notification_counters'
+    
+    # Unread notifications per wallet, adjusted on every insert and mark-read
+    wallet = Column(String(42), primary_key=True)
+    unread_count = Column(Integer, default=0, nullable=False)
+
 class IPRestriction(db.Model):
     __tablename__ = 'ip_restrictions'
     
@@ -368,6 +588,33 @@ class IPRestriction(db.Model):
         Index('idx_ip_restriction_ip_banned', 'ip_address', 'banned_until'),
     )
 
+class IPRangeRestriction(db.Model):
+    __tablename__ = 'ip_range_restrictions'
+    
+    id = Column(Integer, primary_key=True)
+    cidr = Column(String(49), unique=True, nullable=False)
+    wallet_count = Column(Integer, default=0, nullable=False)
+    max_wallets = Column(Integer, nullable=False)
+    banned_until = Column(DateTime, nullable=True)
+    is_active = Column(Boolean, default=True, nullable=False)
+    # system_state version of the last change workers need to pick up
+    revision = Column(Integer, default=0, server_default=text('0'), nullable=False)
+    created_at = Column(DateTime, default=datetime.utcnow, nullable=False)
+    
+    __table_args__ = (
+        Index('idx_ip_range_revision', 'revision'),
+    )
+    
+    def to_dict(self):
+        return {
+            'cidr': self.cidr,
+            'wallet_count': self.wallet_count,
+            'max_wallets': self.max_wallets,
+            'banned_until': self.banned_until.isoformat() if self.banned_until else None,
+            'is_active': self.is_active,
+            'created_at': self.created_at.isoformat()
+        }
+
 class PresaleContribution(db.Model):
     __tablename__ = 'presale_contributions'
     
@@ -509,6 +756,40 @@ class DailyStreak(db.Model):
     created_at = Column(DateTime, default=datetime.utcnow, nullable=False)
     updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow, nullable=False)
 
+class GlobalStat(db.Model):
+    __tablename__ = 'global_stats'
+    
+    # Each counter is split over GLOBAL_STAT_SHARDS rows so concurrent
+    # writers don't all queue on a single row lock
+    name = Column(String(50), primary_key=True)
+    shard = Column(Integer, primary_key=True, default=0)
+    value = Column(Integer, default=0, nullable=False)
+
+class ReferralNetwork(db.Model):
+    __tablename__ = 'referral_networks'
+    
+    # Cached subtree sizes, updated up the ancestor chain on every new referral
+    wallet = Column(String(42), primary_key=True)
+    downline_size = Column(Integer, default=0, nullable=False)
+    active_downline = Column(Integer, default=0, nullable=False)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow, nullable=False)
+
+class WalletBalance(db.Model):
+    __tablename__ = 'wallet_balances'
+    
+    # Sum of the wallet's completed airdrop_claims, kept current by the after_flush hook
+    wallet = Column(String(42), primary_key=True)
+    balance = Column(Float, default=0.0, nullable=False)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow, nullable=False)
+
+class SystemState(db.Model):
+    __tablename__ = 'system_state'
+    
+    # Small key/value store for version stamps shared by all workers
+    key = Column(String(50), primary_key=True)
+    value = Column(String(255), nullable=False)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow, nullable=False)
+
 # Helper class
 class AirdropSystem:
     @staticmethod
@@ -552,57 +833,1349 @@ class AirdropSystem:
         
         return True, wallet
 
-# FIXED: Achievement calculation function
-def check_and_award_achievements(wallet_address):
-    user = User.query.get(wallet_address)
-    if not user:
+def get_unlocked_achievement_ids(wallet_address):
+    return {
+        achievement_id for (achievement_id,)
+        in db.session.query(Achievement.achievement_id).filter_by(wallet=wallet_address)
+    }
+
+def sum_achievement_rewards(unlocked_ids):
+    return sum(a['reward'] for a in ACHIEVEMENTS if a['id'] in unlocked_ids)
+
+def calculate_achievement_rewards(wallet_address):
+    return sum_achievement_rewards(get_unlocked_achievement_ids(wallet_address))
+
+# Leaderboard order: most referrals first, earliest signup wins ties
+LEADERBOARD_ORDER = (User.referral_count.desc(), User.created_at.asc(), User.wallet.asc())
+
+def get_leaderboard_rank(user):
+    """Return the 1-based leaderboard position of user in one query.
+    
+    Users ahead are counted per tie-break level, each count a range scan of
+    idx_user_leaderboard; one OR of the three would keep PostgreSQL off the
+    index. The scans still read every entry ahead of the user, so the cost
+    grows with the rank rather than the table.
+    """
+    levels_ahead = (
+        User.referral_count > user.referral_count,
+        and_(
+            User.referral_count == user.referral_count,
+            User.created_at < user.created_at
+        ),
+        and_(
+            User.referral_count == user.referral_count,
+            User.created_at == user.created_at,
+            User.wallet < user.wallet
+        ),
+    )
+    counts = db.session.query(*[
+        select(func.count()).select_from(User).where(condition).scalar_subquery()
+        for condition in levels_ahead
+    ]).one()
+    
+    return sum(counts) + 1
+
+# ==================== IN-PROCESS CACHES ====================
+
+_MISSING = object()
+
+class TTLCache:
+    """Thread-safe LRU mapping whose entries also expire after ttl seconds"""
+    
+    def __init__(self, maxsize, ttl):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+    
+    def get(self, key, default=None):
+        with self._lock:
+            item = self._data.get(key, _MISSING)
+            if item is _MISSING:
+                return default
+            expires_at, value = item
+            if expires_at <= time.monotonic():
+                del self._data[key]
+                return default
+            self._data.move_to_end(key)
+            return value
+    
+    def set(self, key, value, ttl=None):
+        with self._lock:
+            self._data[key] = (time.monotonic() + (self.ttl if ttl is None else ttl), value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+    
+    def pop(self, key, default=None):
+        with self._lock:
+            item = self._data.pop(key, _MISSING)
+            return default if item is _MISSING else item[1]
+    
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+    
+    def __len__(self):
+        return len(self._data)
+
+# ==================== WITHDRAWAL ELIGIBILITY ====================
+
+WITHDRAWAL_REQUIRED_REFERRALS = 7
+
+def get_withdrawal_eligibility(user):
+    """Eligibility from the denormalized active_referral_count, no referral scan"""
+    active_referrals_count = user.active_referral_count
+    
+    return {
+        'is_eligible': active_referrals_count >= WITHDRAWAL_REQUIRED_REFERRALS,
+        'referral_count': active_referrals_count,
+        'required_count': WITHDRAWAL_REQUIRED_REFERRALS,
+        'remaining_needed': max(0, WITHDRAWAL_REQUIRED_REFERRALS - active_referrals_count)
+    }
+
+# ==================== REFERRAL NETWORK ====================
+
+# Bounds both the per-level report and the ancestor walk; referral
+# codes can form cycles, so every traversal needs a depth limit
+NETWORK_MAX_DEPTH = 10
+NETWORK_DEFAULT_DEPTH = 3
+IN_CLAUSE_CHUNK = 500
+
+def is_postgresql():
+    return db.session.get_bind().dialect.name == 'postgresql'
+
+def upsert_increment(model, key, rows, counters, connection=None):
+    """Insert rows, or add their counter values onto existing rows with the same key.
+    
+    key is a column name, or a tuple of names for a composite key.
+    """
+    if not rows:
+        return
+    
+    bind = connection if connection is not None else db.session.get_bind()
+    insert = postgresql_insert if bind.dialect.name == 'postgresql' else sqlite_insert
+    table = model.__table__
+    stmt = insert(table).values(rows)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[key] if isinstance(key, str) else list(key),
+        set_={name: table.c[name] + stmt.excluded[name] for name in counters}
+    )
+    (connection or db.session).execute(stmt)
+
+def get_referral_ancestors(wallet):
+    """Return wallet and its upline, nearest first, at most NETWORK_MAX_DEPTH long"""
+    if is_postgresql():
+        rows = db.session.execute(text("""
+            WITH RECURSIVE ancestors(wallet, depth) AS (
+                SELECT CAST(:wallet AS VARCHAR(42)), 1
+                UNION ALL
+                SELECT users.referrer, ancestors.depth + 1
+                FROM users JOIN ancestors ON users.wallet = ancestors.wallet
+                WHERE users.referrer IS NOT NULL AND ancestors.depth < :max_depth
+            )
+            SELECT wallet FROM ancestors ORDER BY depth
+        """), {'wallet': wallet, 'max_depth': NETWORK_MAX_DEPTH}).scalars().all()
+    else:
+        rows = [wallet]
+        while len(rows) < NETWORK_MAX_DEPTH:
+            upline = db.session.query(User.referrer).filter(User.wallet == rows[-1]).scalar()
+            if not upline:
+                break
+            rows.append(upline)
+    
+    ancestors = []
+    for ancestor in rows:
+        if ancestor in ancestors:
+            break
+        ancestors.append(ancestor)
+    return ancestors
+
+def record_referral_in_network(referrer_wallet, referee_wallet):
+    """Add the referee's subtree to every cached ancestor, in the caller's transaction"""
+    record_referrals_in_network([(referrer_wallet, referee_wallet)])
+
+def record_referrals_in_network(pairs):
+    """Apply many (referrer, referee) pairs with one subtree lookup and one upsert"""
+    referees = {referee for _, referee in pairs}
+    subtrees = {
+        wallet: (downline, active) for wallet, downline, active in db.session.query(
+            ReferralNetwork.wallet, ReferralNetwork.downline_size, ReferralNetwork.active_downline
+        ).filter(ReferralNetwork.wallet.in_(referees))
+    }
+    
+    ancestors_by_referrer = {}
+    deltas = {}
+    for referrer_wallet, referee_wallet in pairs:
+        if referrer_wallet not in ancestors_by_referrer:
+            ancestors_by_referrer[referrer_wallet] = get_referral_ancestors(referrer_wallet)
+        downline, active = subtrees.get(referee_wallet, (0, 0))
+        for ancestor in ancestors_by_referrer[referrer_wallet]:
+            if ancestor == referee_wallet:
+                continue
+            total = deltas.setdefault(ancestor, [0, 0])
+            total[0] += 1 + downline
+            total[1] += 1 + active
+    
+    now = datetime.utcnow()
+    # Sorted so concurrent folds lock ancestor rows in the same order
+    upsert_increment(ReferralNetwork, 'wallet', [{
+        'wallet': ancestor,
+        'downline_size': downline,
+        'active_downline': active,
+        'updated_at': now
+    } for ancestor, (downline, active) in sorted(deltas.items())], ['downline_size', 'active_downline'])
+
+def get_network_levels(wallet, depth):
+    """Referees and active referees per level of the downline, down to depth"""
+    if is_postgresql():
+        rows = db.session.execute(text("""
+            WITH RECURSIVE downline(wallet, depth) AS (
+                SELECT referee, 1 FROM referrals WHERE referrer = :wallet
+                UNION
+                SELECT referrals.referee, downline.depth + 1
+                FROM referrals JOIN downline ON referrals.referrer = downline.wallet
+                WHERE downline.depth < :max_depth
+            ),
+            -- Like the fallback's seen set: each wallet once, at its shallowest
+            -- level, and never the root, even when referrals form a cycle
+            levels AS (
+                SELECT wallet, MIN(depth) AS depth FROM downline
+                WHERE wallet <> :wallet GROUP BY wallet
+            )
+            SELECT depth,
+                   COUNT(*),
+                   COUNT(*) FILTER (WHERE EXISTS (
+                       SELECT 1 FROM airdrop_claims
+                       WHERE airdrop_claims.wallet = levels.wallet AND airdrop_claims.reward_type = 'airdrop'
+                   ))
+            FROM levels GROUP BY depth ORDER BY depth
+        """), {'wallet': wallet, 'max_depth': depth}).all()
+        return [{'level': level, 'referees': referees, 'active': active} for level, referees, active in rows]
+    
+    levels = []
+    seen = {wallet}
+    frontier = [wallet]
+    for level in range(1, depth + 1):
+        referees = []
+        for i in range(0, len(frontier), IN_CLAUSE_CHUNK):
+            referees += [r for (r,) in db.session.query(Referral.referee).filter(
+                Referral.referrer.in_(frontier[i:i + IN_CLAUSE_CHUNK])
+            )]
+        referees = [r for r in dict.fromkeys(referees) if r not in seen]
+        if not referees:
+            break
+        seen.update(referees)
+        
+        active = 0
+        for i in range(0, len(referees), IN_CLAUSE_CHUNK):
+            active += db.session.query(func.count(distinct(AirdropClaim.wallet))).filter(
+                AirdropClaim.wallet.in_(referees[i:i + IN_CLAUSE_CHUNK]),
+                AirdropClaim.reward_type == 'airdrop'
+            ).scalar()
+        
+        levels.append({'level': level, 'referees': len(referees), 'active': active})
+        frontier = referees
+    
+    return levels
+
+def rebuild_referral_networks():
+    """Recompute every cached subtree size from the referrals table (one-off)"""
+    children = {}
+    for referrer, referee in db.session.query(Referral.referrer, Referral.referee):
+        children.setdefault(referrer, []).append(referee)
+    claimed = {w for (w,) in db.session.query(distinct(AirdropClaim.wallet)).filter(
+        AirdropClaim.reward_type == 'airdrop'
+    )}
+    
+    sizes = {}
+    for root in children:
+        if root in sizes:
+            continue
+        # Iterative post-order walk; a wallet already on the stack is a cycle and is skipped
+        stack = [(root, iter(children.get(root, ())))]
+        on_stack = {root}
+        while stack:
+            node, pending = stack[-1]
+            child = next(pending, None)
+            if child is None:
+                stack.pop()
+                on_stack.discard(node)
+                downline = active = 0
+                for c in children.get(node, ()):
+                    if c in sizes:
+                        downline += 1 + sizes[c][0]
+                        active += (c in claimed) + sizes[c][1]
+                sizes[node] = (downline, active)
+            elif child not in sizes and child not in on_stack:
+                stack.append((child, iter(children.get(child, ()))))
+                on_stack.add(child)
+    
+    ReferralNetwork.query.delete()
+    now = datetime.utcnow()
+    db.session.bulk_insert_mappings(ReferralNetwork, [{
+        'wallet': wallet,
+        'downline_size': downline,
+        'active_downline': active,
+        'updated_at': now
+    } for wallet, (downline, active) in sizes.items() if downline])
+    db.session.commit()
+    
+    return len(sizes)
+
+# ==================== GLOBAL COUNTERS ====================
+
+GLOBAL_STAT_SHARDS = 8
+
+# Tables whose row counts are kept in global_stats by the after_flush hook
+COUNTED_TABLES = {
+    'users': User,
+    'airdrop_claims': AirdropClaim,
+    'referrals': Referral,
+    'achievements': Achievement,
+    'notifications': Notification,
+    'presale_transactions': PresaleTransaction,
+    'tasks': Task,
+    'user_tasks': UserTask,
+    'daily_streaks': DailyStreak,
+}
+
+def _increment_global_stat(connection, name, amount):
+    # One upsert, so two writers creating the same shard row cannot collide
+    if not amount:
         return
+    upsert_increment(GlobalStat, ('name', 'shard'), [{
+        'name': name,
+        'shard': random.randrange(GLOBAL_STAT_SHARDS),
+        'value': amount
+    }], ['value'], connection=connection)
+
+def increment_global_stat(name, amount=1):
+    """Adjust a counter inside the current db.session transaction"""
+    _increment_global_stat(db.session.connection(), name, amount)
+
+def get_global_stats():
+    """Return {name: total} for every counter in one grouped query"""
+    rows = db.session.query(
+        GlobalStat.name, func.sum(GlobalStat.value)
+    ).group_by(GlobalStat.name).all()
+    
+    stats = dict.fromkeys(list(COUNTED_TABLES) + ['active_referrers'], 0)
+    stats.update({name: int(total or 0) for name, total in rows})
+    return stats
+
+def rebuild_global_stats():
+    """Recount every counter from the source tables (one-off, O(table size))"""
+    totals = {name: model.query.count() for name, model in COUNTED_TABLES.items()}
+    totals['active_referrers'] = User.query.filter(User.referral_count > 0).count()
+    
+    GlobalStat.query.delete()
+    for name, total in totals.items():
+        for shard in range(GLOBAL_STAT_SHARDS):
+            db.session.add(GlobalStat(name=name, shard=shard, value=total if shard == 0 else 0))
+    db.session.commit()
+    
+    return totals
+
+@event.listens_for(Session, 'after_flush')
+def count_flushed_rows(session, flush_context):
+    deltas = {}
+    for obj in session.new:
+        name = getattr(obj, '__tablename__', None)
+        if name in COUNTED_TABLES:
+            deltas[name] = deltas.get(name, 0) + 1
+    for obj in session.deleted:
+        name = getattr(obj, '__tablename__', None)
+        if name in COUNTED_TABLES:
+            deltas[name] = deltas.get(name, 0) - 1
+    
+    if deltas:
+        connection = session.connection()
+        for name, amount in deltas.items():
+            _increment_global_stat(connection, name, amount)
+
+def count_core_inserts(connection, name, count):
+    """Count rows that a Core insert added to a COUNTED_TABLES table.
     
-    referral_count = user.referral_count
+    Core inserts must call it: they bypass count_flushed_rows, so their rows
+    would otherwise never reach get_global_stats().
+    """
+    _increment_global_stat(connection, name, count)
+
+# ==================== REWARD LEDGER ====================
+
+# Achievement rewards have no type of their own: they are paid inside the
+# airdrop claim's amount (AirdropClaim.achievement_rewards)
+REWARD_TYPES = ('airdrop', 'task', 'streak')
+
+# Response key for each reward_type in /api/get-total-balance
+BALANCE_BREAKDOWN_KEYS = {
+    'airdrop': 'airdrop',
+    'task': 'task_rewards',
+    'streak': 'streak_bonuses',
+}
+
+def get_wallet_balance(wallet_address):
+    balance = db.session.query(WalletBalance.balance).filter(
+        WalletBalance.wallet == wallet_address
+    ).scalar()
+    return balance or 0.0
+
+def get_balance_breakdown(wallet_address):
+    """Return {reward_type: total} for the wallet's completed claims in one grouped query"""
+    rows = db.session.query(
+        AirdropClaim.reward_type, func.sum(AirdropClaim.amount)
+    ).filter(
+        AirdropClaim.wallet == wallet_address,
+        AirdropClaim.status == 'completed'
+    ).group_by(AirdropClaim.reward_type).all()
     
-    current_achievements = Achievement.query.filter_by(wallet=wallet_address).all()
-    current_achievement_ids = [a.achievement_id for a in current_achievements]
+    breakdown = dict.fromkeys(REWARD_TYPES, 0.0)
+    breakdown.update({reward_type: float(total or 0) for reward_type, total in rows})
+    return breakdown
+
+def rebuild_wallet_balances():
+    """Recompute every balance from airdrop_claims (one-off, O(table size))"""
+    WalletBalance.query.delete()
+    db.session.execute(
+        WalletBalance.__table__.insert().from_select(
+            ['wallet', 'balance', 'updated_at'],
+            db.session.query(
+                AirdropClaim.wallet, func.sum(AirdropClaim.amount), func.max(AirdropClaim.claimed_at)
+            ).filter(AirdropClaim.status == 'completed').group_by(AirdropClaim.wallet)
+        )
+    )
+    db.session.commit()
+
+@event.listens_for(Session, 'after_flush')
+def apply_claims_to_balances(session, flush_context):
+    deltas = {}
+    for sign, objects in ((1, session.new), (-1, session.deleted)):
+        for obj in objects:
+            if isinstance(obj, AirdropClaim) and obj.status == 'completed':
+                deltas[obj.wallet] = deltas.get(obj.wallet, 0.0) + sign * obj.amount
+    
+    if deltas:
+        credit_wallet_balances(deltas, session)
+
+def credit_wallet_balances(deltas, session):
+    """Add {wallet: amount} onto wallet_balances in the session's transaction"""
+    now = datetime.utcnow()
+    upsert_increment(
+        WalletBalance, 'wallet',
+        [{'wallet': wallet, 'balance': amount, 'updated_at': now} for wallet, amount in deltas.items()],
+        ['balance'],
+        connection=session.connection()
+    )
+    for wallet, amount in deltas.items():
+        event_broker.stage(wallet, 'balance', {'delta': amount}, session=session)
+
+# ==================== WRITE-BEHIND SPOOL ====================
+
+class Spool:
+    """Per-process append-only JSON-lines log for records that still have to reach the database.
+    
+    append() lands records on disk before they are acknowledged to anyone.
+    rotate() seals the active log into a segment that is deleted with ack()
+    once its records are stored; segments left behind by dead processes
+    are picked up again by recover().
+    """
+    
+    def __init__(self, name, directory=None):
+        directory = directory or SPOOL_DIR
+        if not directory:
+            raise OSError('SPOOL_DIR is not set')
+        self.name = name
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+    
+    def _active_path(self, pid=None):
+        return os.path.join(self.directory, f'{self.name}.{pid or os.getpid()}.log')
+    
+    def append(self, records):
+        with open(self._active_path(), 'a') as f:
+            for record in records:
+                f.write(json.dumps(record) + '\n')
+            f.flush()
+            os.fsync(f.fileno())
+    
+    def rotate(self):
+        """Seal the active log and return its segment path, or None if it was empty"""
+        active = self._active_path()
+        if not os.path.exists(active):
+            return None
+        segment = os.path.join(self.directory, f'{self.name}.{os.getpid()}.{time.time_ns()}.pending')
+        os.rename(active, segment)
+        return segment
+    
+    def read(self, segment):
+        records = []
+        with open(segment) as f:
+            for line in f:
+                try:
+                    records.append(json.loads(line))
+                except ValueError:
+                    # A torn last line from a crash mid-append was never acknowledged
+                    continue
+        return records
     
-    for achievement in ACHIEVEMENTS:
-        if achievement['id'] not in current_achievement_ids:
-            should_award = False
+    def ack(self, segment):
+        try:
+            os.remove(segment)
+        except FileNotFoundError:
+            pass
+    
+    def recover(self):
+        """Adopt segments and active logs of processes that are no longer running"""
+        recovered = []
+        for filename in sorted(os.listdir(self.directory)):
+            parts = filename.split('.')
+            if parts[0] != self.name or len(parts) < 3 or not parts[1].isdigit():
+                continue
             
-            if achievement['id'] == 'first_claim':
-                claim = AirdropClaim.query.filter_by(wallet=wallet_address).first()
-                if claim:
-                    should_award = True
-            elif achievement['requirement'] <= referral_count:
-                should_award = True
+            pid = int(parts[1])
+            if pid != os.getpid() and process_is_alive(pid):
+                continue
+            if pid == os.getpid() and filename.endswith('.log'):
+                continue
             
-            if should_award:
-                achievement_record = Achievement(
-                    wallet=wallet_address,
-                    achievement_id=achievement['id']
-                )
-                db.session.add(achievement_record)
-                
-                notification = Notification(
-                    id=AirdropSystem.generate_notification_id(),
-                    wallet=wallet_address,
-                    type='achievement',
-                    message=f'🏆 Achievement unlocked: {achievement["name"]}! +{achievement["reward"]} APRO',
-                    timestamp=datetime.utcnow(),
-                    read=False
-                )
-                db.session.add(notification)
+            segment = os.path.join(self.directory, f'{self.name}.{os.getpid()}.{time.time_ns()}.pending')
+            try:
+                os.rename(os.path.join(self.directory, filename), segment)
+            except FileNotFoundError:
+                # Another worker adopted it first
+                continue
+            recovered.append(segment)
+        return recovered
+
+def process_is_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+# ==================== LIVE EVENT BROKER ====================
+
+class EventBroker:
+    """Per-wallet pub/sub feeding the /api/events SSE streams.
+    
+    Subscribers live in the worker that accepted the connection, so every
+    publish is delivered locally and also sent as a datagram to each sibling
+    worker's UNIX socket in EVENT_SOCKET_DIR, which stands in for a shared
+    broker. Delivery is best effort: a slow client or a full socket drops
+    events rather than blocking the publisher.
+    """
+    
+    SUBSCRIBER_QUEUE_SIZE = 100
+    
+    def __init__(self, directory):
+        self.directory = directory
+        self._pid = None
+    
+    def _ensure_started(self):
+        # Sockets and threads don't survive fork, so each worker binds its own
+        if self._pid == os.getpid():
+            return
+        self._pid = os.getpid()
+        self._lock = threading.Lock()
+        self._subscribers = {}
+        self._sender = None
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            path = self._socket_path(os.getpid())
+            if os.path.exists(path):
+                os.remove(path)
+            receiver = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+            receiver.bind(path)
+            self._sender = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+            self._sender.setblocking(False)
+            threading.Thread(target=self._receive, args=(receiver,), daemon=True, name='event-broker').start()
+        except OSError as e:
+            print(f"⚠️  Live events limited to this worker: {e}")
+    
+    def _socket_path(self, pid):
+        return os.path.join(self.directory, f'{pid}.sock')
+    
+    def _receive(self, receiver):
+        while True:
+            try:
+                message = json.loads(receiver.recv(65536))
+                self._deliver(message['wallet'], message['event'], message['data'])
+            except Exception as e:
+                print(f"⚠️  Dropped live event: {e}")
     
+    def _deliver(self, wallet, event_name, data):
+        with self._lock:
+            subscribers = list(self._subscribers.get(wallet, ()))
+        for subscriber in subscribers:
+            try:
+                subscriber.put_nowait((event_name, data))
+            except queue.Full:
+                pass
+    
+    def subscribe(self, wallet):
+        self._ensure_started()
+        subscriber = queue.Queue(maxsize=self.SUBSCRIBER_QUEUE_SIZE)
+        with self._lock:
+            self._subscribers.setdefault(wallet, []).append(subscriber)
+        return subscriber
+    
+    def unsubscribe(self, wallet, subscriber):
+        with self._lock:
+            subscribers = self._subscribers.get(wallet, [])
+            if subscriber in subscribers:
+                subscribers.remove(subscriber)
+            if not subscribers:
+                self._subscribers.pop(wallet, None)
+    
+    def publish(self, wallet, event_name, data):
+        self._ensure_started()
+        self._deliver(wallet, event_name, data)
+        if self._sender is None:
+            return
+        
+        message = json.dumps({'wallet': wallet, 'event': event_name, 'data': data}).encode()
+        own_socket = f'{os.getpid()}.sock'
+        for filename in os.listdir(self.directory):
+            if not filename.endswith('.sock') or filename == own_socket:
+                continue
+            path = os.path.join(self.directory, filename)
+            try:
+                self._sender.sendto(message, path)
+            except (ConnectionRefusedError, FileNotFoundError):
+                # Left behind by a worker that has exited
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+            except OSError:
+                # Receiver's buffer is full; live events are best effort
+                pass
+    
+    def stage(self, wallet, event_name, data, session=None):
+        """Publish the event only if the current transaction commits"""
+        session = session or db.session()
+        if session.get_transaction() is None:
+            session.begin()
+        session.info.setdefault('staged_events', []).append((wallet, event_name, data))
+
+event_broker = EventBroker(EVENT_SOCKET_DIR)
+
+@event.listens_for(Session, 'after_commit')
+def release_staged_events(session):
+    for wallet, event_name, data in session.info.pop('staged_events', ()):
+        event_broker.publish(wallet, event_name, data)
+
+@event.listens_for(Session, 'after_soft_rollback')
+def discard_staged_events(session, previous_transaction):
+    session.info.pop('staged_events', None)
+
+# ==================== NOTIFICATIONS ====================
+
+NOTIFICATION_BATCH_SIZE = 1000
+
+def build_notification_row(wallet, notification_type, message, timestamp=None):
+    return {
+        'id': AirdropSystem.generate_notification_id(),
+        'wallet': wallet,
+        'type': notification_type,
+        'message': message,
+        'timestamp': timestamp or datetime.utcnow(),
+        'read': False
+    }
+
+def insert_notification_rows(connection, rows):
+    """Multi-row insert that skips ids already stored, so replays are harmless.
+    
+    Returns the ids that were actually inserted.
+    """
+    if not rows:
+        return []
+    
+    insert = postgresql_insert if connection.dialect.name == 'postgresql' else sqlite_insert
+    table = Notification.__table__
+    stmt = insert(table).values(rows).on_conflict_do_nothing(
+        index_elements=['id']
+    ).returning(table.c.id, table.c.wallet, table.c.read)
+    
+    unread = {}
+    inserted = []
+    for notification_id, wallet, read in connection.execute(stmt):
+        inserted.append(notification_id)
+        if not read:
+            unread[wallet] = unread.get(wallet, 0) + 1
+    
+    if inserted:
+        count_core_inserts(connection, 'notifications', len(inserted))
+        upsert_increment(
+            NotificationCounter, 'wallet',
+            [{'wallet': wallet, 'unread_count': count} for wallet, count in unread.items()],
+            ['unread_count'],
+            connection=connection
+        )
+    return inserted
+
+def publish_notifications(rows, inserted_ids):
+    inserted_ids = set(inserted_ids)
+    for row in rows:
+        if row['id'] in inserted_ids:
+            event_broker.publish(row['wallet'], 'notification', {
+                'id': row['id'],
+                'type': row['type'],
+                'message': row['message'],
+                'timestamp': row['timestamp'].isoformat(),
+                'read': row['read']
+            })
+
+def get_unread_count(wallet_address):
+    count = db.session.query(NotificationCounter.unread_count).filter(
+        NotificationCounter.wallet == wallet_address
+    ).scalar()
+    return max(count or 0, 0)
+
+def mark_notifications_read(notification_ids=None, wallet_address=None, before=None):
+    """Flip unread rows to read in one UPDATE and take them off their wallets' counters.
+    
+    Narrowed by ids, wallet and/or a (timestamp, id) cursor; the caller commits.
+    """
+    query = update(Notification.__table__).where(Notification.read == False)
+    if notification_ids is not None:
+        query = query.where(Notification.id.in_(notification_ids))
+    if wallet_address:
+        query = query.where(Notification.wallet == wallet_address)
+    if before:
+        query = query.where(notifications_before(*before))
+    
+    read_by_wallet = {}
+    for (wallet,) in db.session.execute(query.values(read=True).returning(Notification.wallet)):
+        read_by_wallet[wallet] = read_by_wallet.get(wallet, 0) + 1
+    
+    for wallet, count in read_by_wallet.items():
+        db.session.execute(
+            update(NotificationCounter.__table__)
+            .where(NotificationCounter.wallet == wallet)
+            .values(unread_count=NotificationCounter.unread_count - count)
+        )
+    return sum(read_by_wallet.values())
+
+def rebuild_notification_counters():
+    """Recount unread notifications per wallet (one-off, O(table size))"""
+    NotificationCounter.query.delete()
+    db.session.execute(
+        NotificationCounter.__table__.insert().from_select(
+            ['wallet', 'unread_count'],
+            db.session.query(Notification.wallet, func.count(Notification.id))
+            .filter(Notification.read == False)
+            .group_by(Notification.wallet)
+        )
+    )
     db.session.commit()
 
-def calculate_achievement_rewards(wallet_address):
-    user_achievements = Achievement.query.filter_by(wallet=wallet_address).all()
-    achievement_ids = [a.achievement_id for a in user_achievements]
+NOTIFICATION_PAGE_SIZE = 50
+MAX_NOTIFICATION_PAGE_SIZE = 100
+
+MAX_MARK_READ_IDS = 500
+
+def notifications_before(before_timestamp, before_id):
+    """Keyset condition on (timestamp, id), served by idx_notification_wallet_timestamp_id"""
+    return or_(
+        Notification.timestamp < before_timestamp,
+        and_(Notification.timestamp == before_timestamp, Notification.id < before_id)
+    )
+
+def encode_notification_cursor(notification):
+    return f"{notification.timestamp.isoformat()}|{notification.id}"
+
+def decode_notification_cursor(cursor):
+    timestamp, notification_id = cursor.split('|', 1)
+    return datetime.fromisoformat(timestamp), notification_id
+
+class NotificationWriter:
+    """Write-behind queue for Notification rows.
+    
+    Endpoints stage() rows on the session. Just before that transaction
+    commits they are appended to the spool, and once it has committed a
+    background thread inserts them in multi-row batches every
+    NOTIFICATION_FLUSH_SECONDS or NOTIFICATION_FLUSH_SIZE rows, whichever
+    comes first. A rollback appends a cancel record for them instead.
+    Delivery is at-least-once; replays are dropped by the primary key. A
+    worker that dies mid-commit leaves rows whose outcome is unknown, and
+    the next worker inserts them.
+    
+    Without a usable spool (SPOOL_DIR unset or unwritable) the rows are
+    inserted in the caller's own transaction instead.
+    """
+    
+    def __init__(self, flush_size, flush_seconds):
+        self.flush_size = flush_size
+        self.flush_seconds = flush_seconds
+        self.spool = None
+        self._pid = None
+    
+    def _ensure_started(self):
+        """Open this process's spool and start its flush thread; raises OSError if the spool is unusable"""
+        # Threads and locks don't survive fork, so each worker starts its own
+        if self._pid == os.getpid():
+            return
+        spool = Spool('notifications')
+        segments = spool.recover()
+        
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._queued = 0
+        # Ids spooled by transactions that have not finished, and ids rolled back
+        self._in_flight = set()
+        self._cancelled = set()
+        self._segments = segments
+        self.spool = spool
+        # Only now, so a failed start is retried instead of leaving a half-built writer
+        self._pid = os.getpid()
+        threading.Thread(target=self._run, daemon=True, name='notification-writer').start()
+    
+    def stage(self, wallet, notification_type, message, timestamp=None):
+        """Queue a notification to be written if the current transaction commits"""
+        row = build_notification_row(wallet, notification_type, message, timestamp)
+        if db.session().get_transaction() is None:
+            # Begin explicitly so a rollback with nothing else pending still discards the row
+            db.session.begin()
+        db.session.info.setdefault('staged_notifications', []).append(row)
+        return row
+    
+    def spool_pending(self, rows):
+        """Land rows on disk before their transaction commits; raises OSError if the spool is unusable"""
+        records = [dict(row, timestamp=row['timestamp'].isoformat()) for row in rows]
+        self._ensure_started()
+        with self._lock:
+            self.spool.append(records)
+            self._in_flight.update(row['id'] for row in rows)
+    
+    def committed(self, rows):
+        with self._lock:
+            self._in_flight.difference_update(row['id'] for row in rows)
+            self._queued += len(rows)
+            if self._queued >= self.flush_size:
+                self._wakeup.set()
+    
+    def cancelled(self, rows):
+        ids = [row['id'] for row in rows]
+        with self._lock:
+            self._in_flight.difference_update(ids)
+            self._cancelled.update(ids)
+            try:
+                # Lets the next worker skip them too if this one dies before flushing
+                self.spool.append([{'cancel': ids}])
+            except OSError as e:
+                print(f"⚠️  Could not spool cancelled notifications: {e}")
+    
+    def _run(self):
+        while True:
+            self._wakeup.wait(self.flush_seconds)
+            self._wakeup.clear()
+            try:
+                self.flush()
+            except Exception as e:
+                print(f"⚠️  Notification flush failed, will retry: {e}")
+    
+    def flush(self):
+        """Write every spooled notification; returns the number of rows inserted"""
+        if self._pid != os.getpid():
+            return 0
+        
+        with self._flush_lock:
+            with self._lock:
+                segment = self.spool.rotate()
+                self._queued = 0
+                # Rows are always spooled before their cancel, so every id
+                # cancelled by now belongs to a segment handled below
+                cancelled = set(self._cancelled)
+            if segment:
+                self._segments.append(segment)
+            
+            inserted = 0
+            while self._segments:
+                segment = self._segments[0]
+                records = self.spool.read(segment)
+                skipped = cancelled.union(*(r['cancel'] for r in records if 'cancel' in r))
+                rows = []
+                carried = []
+                with self._lock:
+                    for record in records:
+                        if 'cancel' in record or record['id'] in skipped:
+                            continue
+                        if record['id'] in self._in_flight:
+                            carried.append(record)
+                        else:
+                            rows.append(dict(record, timestamp=datetime.fromisoformat(record['timestamp'])))
+                    if carried:
+                        # Their transaction is still deciding; keep them for the next flush
+                        self.spool.append(carried)
+                
+                inserted_ids = []
+                with app.app_context():
+                    with db.engine.begin() as connection:
+                        for i in range(0, len(rows), NOTIFICATION_BATCH_SIZE):
+                            inserted_ids += insert_notification_rows(connection, rows[i:i + NOTIFICATION_BATCH_SIZE])
+                self.spool.ack(segment)
+                self._segments.pop(0)
+                inserted += len(inserted_ids)
+                publish_notifications(rows, inserted_ids)
+            
+            with self._lock:
+                self._cancelled -= cancelled
+            return inserted
+
+notification_writer = NotificationWriter(NOTIFICATION_FLUSH_SIZE, NOTIFICATION_FLUSH_SECONDS)
+
+@event.listens_for(Session, 'before_commit')
+def spool_staged_notifications(session):
+    rows = session.info.pop('staged_notifications', None)
+    if not rows:
+        return
+    if SPOOL_DIR:
+        try:
+            notification_writer.spool_pending(rows)
+            session.info['spooled_notifications'] = rows
+            return
+        except OSError as e:
+            print(f"⚠️  Notification spool unavailable, writing in the transaction: {e}")
+    inserted_ids = insert_notification_rows(session.connection(), rows)
+    session.info['written_notifications'] = (rows, inserted_ids)
+
+@event.listens_for(Session, 'after_commit')
+def release_staged_notifications(session):
+    spooled = session.info.pop('spooled_notifications', None)
+    written = session.info.pop('written_notifications', None)
+    # The caller's transaction is already committed and its rows are durable;
+    # an exception here would only turn its successful request into a 500
+    try:
+        if spooled:
+            notification_writer.committed(spooled)
+        if written:
+            publish_notifications(*written)
+    except Exception as e:
+        print(f"⚠️  Could not release committed notifications: {e}")
+
+@event.listens_for(Session, 'after_soft_rollback')
+def discard_staged_notifications(session, previous_transaction):
+    session.info.pop('staged_notifications', None)
+    session.info.pop('written_notifications', None)
+    spooled = session.info.pop('spooled_notifications', None)
+    if spooled:
+        notification_writer.cancelled(spooled)
+
+@atexit.register
+def flush_notifications_on_exit():
+    try:
+        notification_writer.flush()
+    except Exception as e:
+        print(f"⚠️  Notifications left in spool for the next worker: {e}")
+
+# ==================== LINK CLICKS ====================
+
+class LinkClickBuffer:
+    """Per-worker referral link-click counts, folded into users.link_clicks in the background.
+    
+    record() only appends to the spool and bumps an in-memory counter, so a
+    click never waits on the database. Every LINK_CLICK_FLUSH_SECONDS the
+    spool is rotated together with the counter and applied as one
+    UPDATE users SET link_clicks = link_clicks + n per code. Segments of a
+    crashed worker are recounted from disk by the next one; a crash between
+    commit and ack replays that segment (at-least-once).
+    """
+    
+    def __init__(self, flush_seconds):
+        self.flush_seconds = flush_seconds
+        self.spool = None
+        self._pid = None
+    
+    def _ensure_started(self):
+        # Threads and locks don't survive fork, so each worker starts its own
+        if self._pid == os.getpid():
+            return
+        self._pid = os.getpid()
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._counts = Counter()
+        self._segments = []
+        self.spool = None
+        if SPOOL_DIR:
+            try:
+                self.spool = Spool('link_clicks')
+                self._segments.extend((segment, None) for segment in self.spool.recover())
+            except OSError as e:
+                print(f"⚠️  Link click spool unavailable, counting in memory only: {e}")
+                self.spool = None
+        threading.Thread(target=self._run, daemon=True, name='link-click-buffer').start()
+    
+    def record(self, referral_code):
+        self._ensure_started()
+        with self._lock:
+            if self.spool:
+                try:
+                    self.spool.append([{'code': referral_code}])
+                except OSError as e:
+                    print(f"⚠️  Link click spool unavailable, counting in memory only: {e}")
+            self._counts[referral_code] += 1
+    
+    def _run(self):
+        while True:
+            time.sleep(self.flush_seconds)
+            try:
+                self.flush()
+            except Exception as e:
+                print(f"⚠️  Link click flush failed, will retry: {e}")
+    
+    def flush(self):
+        """Apply every buffered click; returns the number of clicks written"""
+        if self._pid != os.getpid():
+            return 0
+        
+        with self._flush_lock:
+            with self._lock:
+                segment = self.spool.rotate() if self.spool else None
+                counts, self._counts = self._counts, Counter()
+            if segment or counts:
+                self._segments.append((segment, counts or None))
+            
+            applied = 0
+            while self._segments:
+                segment, counts = self._segments[0]
+                if counts is None:
+                    counts = Counter(record['code'] for record in self.spool.read(segment))
+                with app.app_context():
+                    with db.engine.begin() as connection:
+                        apply_link_clicks(connection, counts)
+                if segment:
+                    self.spool.ack(segment)
+                self._segments.pop(0)
+                applied += sum(counts.values())
+            return applied
+
+def apply_link_clicks(connection, counts):
+    """One atomic increment per code; sorted so concurrent flushes lock rows in the same order"""
+    table = User.__table__
+    for referral_code, clicks in sorted(counts.items()):
+        connection.execute(
+            update(table)
+            .where(table.c.referral_code == referral_code)
+            .values(link_clicks=table.c.link_clicks + clicks)
+        )
+
+link_click_buffer = LinkClickBuffer(LINK_CLICK_FLUSH_SECONDS)
+
+@atexit.register
+def flush_link_clicks_on_exit():
+    try:
+        link_click_buffer.flush()
+    except Exception as e:
+        print(f"⚠️  Link clicks left in spool for the next worker: {e}")
+
+# ==================== ACHIEVEMENT ENGINE ====================
+
+# Per-wallet counters the achievement rules are written against. Each entry
+# builds a scalar SQL expression for the wallet given as a value or column.
+ACHIEVEMENT_METRICS = {
+    'claims': lambda wallet: select(func.count(AirdropClaim.id)).where(
+        AirdropClaim.wallet == wallet, AirdropClaim.reward_type == 'airdrop'
+    ).scalar_subquery(),
+    'referrals': lambda wallet: select(func.coalesce(func.max(User.referral_count), 0)).where(
+        User.wallet == wallet
+    ).scalar_subquery(),
+    'tasks_completed': lambda wallet: select(func.count(UserTask.id)).where(
+        UserTask.wallet == wallet, UserTask.status.in_(['completed', 'claimed'])
+    ).scalar_subquery(),
+}
+
+# Metrics that can change when an event happens; a claim is the wallet's
+# entry point, so it also picks up referrals gathered before claiming
+ACHIEVEMENT_EVENTS = {
+    'claim': ('claims', 'referrals'),
+    'referral': ('referrals',),
+    'task_completion': ('tasks_completed',),
+}
+
+class AchievementEngine:
+    """Awards ACHIEVEMENTS in reaction to domain events, inside the caller's transaction"""
+    
+    def __init__(self, achievements):
+        self.achievements = achievements
+        self.rules_by_event = {}
+        for event_name, metrics in ACHIEVEMENT_EVENTS.items():
+            self.rules_by_event[event_name] = [a for a in achievements if a['metric'] in metrics]
+    
+    def load_snapshot(self, wallet_address, metrics):
+        """Return ({metric: value}, unlocked_ids) in two queries regardless of rule count"""
+        row = db.session.query(*[
+            ACHIEVEMENT_METRICS[metric](wallet_address).label(metric) for metric in metrics
+        ]).one()
+        counters = {metric: value or 0 for metric, value in zip(metrics, row)}
+        return counters, get_unlocked_achievement_ids(wallet_address)
+    
+    def on_event(self, wallet_address, event_name):
+        """Stage newly earned achievements and their notifications; the caller commits"""
+        rules = self.rules_by_event[event_name]
+        if not rules:
+            return []
+        
+        metrics = sorted({rule['metric'] for rule in rules})
+        counters, unlocked_ids = self.load_snapshot(wallet_address, metrics)
+        
+        awarded = [
+            rule for rule in rules
+            if rule['id'] not in unlocked_ids and counters[rule['metric']] >= rule['threshold']
+        ]
+        if not awarded:
+            return []
+        
+        now = datetime.utcnow()
+        db.session.add_all([
+            Achievement(wallet=wallet_address, achievement_id=rule['id'], unlocked_at=now)
+            for rule in awarded
+        ])
+        for rule in awarded:
+            notification_writer.stage(
+                wallet_address, 'achievement',
+                f'🏆 Achievement unlocked: {rule["name"]}! +{rule["reward"]} APRO',
+                timestamp=now
+            )
+        return awarded
+
+achievement_engine = AchievementEngine(ACHIEVEMENTS)
+
+# ==================== REFERRAL COUNTERS ====================
+
+REFERRAL_FOLD_BATCH_SIZE = 1000
+
+def increment_referral_counters(condition, count=1):
+    """Add count referrals to the user matching condition with one UPDATE ... RETURNING.
+    
+    The increments happen in SQL, so concurrent writers never lose a count.
+    Returns the referrer's wallet, or None when no row matched.
+    """
+    row = db.session.execute(
+        update(User)
+        .where(condition)
+        .values(
+            referral_count=User.referral_count + count,
+            link_conversions=User.link_conversions + count,
+            # Referees are counted when their claim is written, so they count as active
+            active_referral_count=User.active_referral_count + count,
+            active=case((User.referral_count + count >= 2, True), else_=User.active)
+        )
+        .returning(User.wallet, User.referral_count)
+        .execution_options(synchronize_session=False)
+    ).first()
+    if not row:
+        return None
+    
+    referrer_wallet, referral_count = row
+    if referral_count == count:
+        increment_global_stat('active_referrers')
+    return referrer_wallet
+
+class ReferralAggregator:
+    """Folds referral_events into users, referral_networks and achievements.
+    
+    In deferred mode a claim appends one referral_events row instead of
+    updating its referrer, so a popular code no longer serializes every claim
+    on one row lock. Each worker folds every REFERRAL_FOLD_SECONDS: a batch
+    is taken with DELETE ... RETURNING (SKIP LOCKED on PostgreSQL), so
+    concurrent folds never apply an event twice, and the referrer's row is
+    touched once per batch rather than once per claim.
+    """
+    
+    def __init__(self, fold_seconds):
+        self.fold_seconds = fold_seconds
+        self._pid = None
+    
+    def ensure_started(self):
+        # Threads don't survive fork, so each worker starts its own
+        if self._pid == os.getpid():
+            return
+        self._pid = os.getpid()
+        threading.Thread(target=self._run, daemon=True, name='referral-aggregator').start()
+    
+    def _run(self):
+        while True:
+            time.sleep(self.fold_seconds)
+            try:
+                while self.fold() == REFERRAL_FOLD_BATCH_SIZE:
+                    pass
+            except Exception as e:
+                print(f"⚠️  Referral fold failed, will retry: {e}")
     
-    achievement_rewards = 0
-    for achievement in ACHIEVEMENTS:
-        if achievement['id'] in achievement_ids:
-            achievement_rewards += achievement['reward']
+    def fold(self):
+        """Apply up to REFERRAL_FOLD_BATCH_SIZE pending events; returns how many were applied"""
+        with app.app_context():
+            try:
+                batch = select(ReferralEvent.id).order_by(ReferralEvent.id).limit(
+                    REFERRAL_FOLD_BATCH_SIZE
+                ).with_for_update(skip_locked=True)
+                events = db.session.execute(
+                    delete(ReferralEvent)
+                    .where(ReferralEvent.id.in_(batch))
+                    .returning(ReferralEvent.referrer, ReferralEvent.referee)
+                    .execution_options(synchronize_session=False)
+                ).all()
+                if not events:
+                    db.session.rollback()
+                    return 0
+                
+                pairs = [tuple(row) for row in events]
+                # Sorted so concurrent folds lock referrer rows in the same order
+                for referrer_wallet, count in sorted(Counter(r for r, _ in pairs).items()):
+                    increment_referral_counters(User.wallet == referrer_wallet, count)
+                record_referrals_in_network(pairs)
+                for referrer_wallet in sorted({r for r, _ in pairs}):
+                    achievement_engine.on_event(referrer_wallet, 'referral')
+                
+                db.session.commit()
+                return len(pairs)
+            except Exception:
+                db.session.rollback()
+                raise
+
+referral_aggregator = ReferralAggregator(REFERRAL_FOLD_SECONDS)
+
+@app.before_request
+def start_referral_aggregator():
+    # Every worker folds, so events left by a stopped worker are picked up too
+    if REFERRAL_COUNTER_MODE == 'deferred':
+        referral_aggregator.ensure_started()
+
+@atexit.register
+def fold_referrals_on_exit():
+    if referral_aggregator._pid != os.getpid():
+        return
+    try:
+        while referral_aggregator.fold() == REFERRAL_FOLD_BATCH_SIZE:
+            pass
+    except Exception as e:
+        print(f"⚠️  Referral events left for the next worker: {e}")
+
+# ==================== SYSTEM STATE ====================
+
+def get_system_state(key, default=None):
+    value = db.session.query(SystemState.value).filter(SystemState.key == key).scalar()
+    return default if value is None else value
+
+def next_system_version(key):
+    """Atomically increment an integer key in the current transaction and return the new value.
+    
+    The row lock orders concurrent writers, so every transaction gets its own version.
+    """
+    insert = postgresql_insert if is_postgresql() else sqlite_insert
+    table = SystemState.__table__
+    stmt = insert(table).values(key=key, value='1', updated_at=datetime.utcnow())
+    stmt = stmt.on_conflict_do_update(
+        index_elements=['key'],
+        set_={
+            'value': cast(cast(table.c.value, Integer) + 1, String(255)),
+            'updated_at': stmt.excluded.updated_at
+        }
+    ).returning(table.c.value)
+    return int(db.session.execute(stmt).scalar())
+
+def set_system_state(key, value):
+    """Upsert a key in the current transaction; the caller commits"""
+    state = SystemState.query.get(key)
+    if state:
+        state.value = str(value)
+    else:
+        db.session.add(SystemState(key=key, value=str(value)))
+
+# ==================== TASK CATALOG ====================
+
+TASK_CATALOG_VERSION_KEY = 'task_catalog_version'
+TASK_FIELDS = ('title', 'description', 'category', 'type', 'reward_apro', 'max_completions',
+               'is_active', 'requires_verification', 'verification_type')
+
+class TaskCatalog:
+    """Task definitions indexed by id and grouped by category and type.
+    
+    Built from the tasks table layered over the TASKS seed, which still
+    supplies the extra fields (links, hashtags, ...) the table has no
+    columns for. Each worker re-reads the version stamp in system_state at
+    most every TASK_CATALOG_CHECK_SECONDS and reloads when it has moved, so
+    bump_version() propagates an edit to every gunicorn worker.
+    """
+    
+    def __init__(self, check_seconds):
+        self.check_seconds = check_seconds
+        self.version = None
+        self._lock = threading.Lock()
+        self._checked_at = 0.0
+        self._by_id = {}
+        self._active_by_category = {}
+        self._active_by_type = {}
+    
+    def get(self, task_id):
+        self._ensure_fresh()
+        return self._by_id.get(task_id)
+    
+    def active_tasks(self):
+        self._ensure_fresh()
+        return [t for tasks in self._active_by_category.values() for t in tasks]
+    
+    def active_by_category(self):
+        self._ensure_fresh()
+        return self._active_by_category
+    
+    def active_by_type(self):
+        self._ensure_fresh()
+        return self._active_by_type
+    
+    def bump_version(self):
+        """Mark the catalog as changed for every worker in the current transaction.
+        
+        The caller commits and then calls reload(str(version)) for this worker.
+        """
+        return next_system_version(TASK_CATALOG_VERSION_KEY)
     
-    return achievement_rewards
+    def reload(self, version=None):
+        by_id = {t['id']: dict(t) for t in TASKS}
+        columns = [Task.__table__.c[name] for name in ('id',) + TASK_FIELDS]
+        try:
+            # Own connection: a failed read must not abort the caller's transaction
+            with db.engine.connect() as conn:
+                for row in conn.execute(select(*columns)).mappings():
+                    task_def = by_id.setdefault(row['id'], {'id': row['id']})
+                    for field in TASK_FIELDS:
+                        task_def[field] = row[field]
+        except Exception as e:
+            print(f"⚠️  Could not load tasks table, using TASKS seed: {e}")
+        
+        active_by_category = {}
+        active_by_type = {}
+        for task_def in by_id.values():
+            if not task_def.get('is_active', True):
+                continue
+            active_by_category.setdefault(task_def['category'], []).append(task_def)
+            active_by_type.setdefault(task_def['type'], []).append(task_def)
+        
+        # Swap in complete structures so readers never see a half-built catalog
+        self._by_id = by_id
+        self._active_by_category = active_by_category
+        self._active_by_type = active_by_type
+        self.version = version
+    
+    def _ensure_fresh(self):
+        if self._by_id and time.monotonic() - self._checked_at < self.check_seconds:
+            return
+        
+        with self._lock:
+            if self._by_id and time.monotonic() - self._checked_at < self.check_seconds:
+                return
+            version = get_system_state(TASK_CATALOG_VERSION_KEY, '0')
+            if version != self.version or not self._by_id:
+                self.reload(version)
+            self._checked_at = time.monotonic()
+
+task_catalog = TaskCatalog(TASK_CATALOG_CHECK_SECONDS)
 
 # ==================== SAFE DATABASE CREATION ====================
 
@@ -617,6 +2190,137 @@ def safe_create_tables():
             print(f"⚠️  Database tables may already exist: {e}")
             print("Continuing with existing database structure...")
 
+def upgrade_schema():
+    """Add columns and indexes that db.create_all() skips on existing tables.
+    
+    New columns are backfilled before the table's indexes are built, since a
+    partial index may filter on them. A unique index that still cannot be
+    built raises: the claim path relies on it to refuse double claims.
+    """
+    engine = db.engine
+    inspector = inspect(engine)
+    existing_tables = set(inspector.get_table_names())
+    added_columns = []
+    
+    for table in db.metadata.sorted_tables:
+        if table.name not in existing_tables:
+            continue
+        
+        added_to_table = []
+        existing_columns = {c['name'] for c in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name in existing_columns:
+                continue
+            
+            ddl = f'ALTER TABLE {table.name} ADD COLUMN {column.name} {column.type.compile(dialect=engine.dialect)}'
+            if column.server_default is not None:
+                default = column.server_default.arg
+                ddl += f" DEFAULT {default.text if hasattr(default, 'text') else repr(default)}"
+                if not column.nullable:
+                    ddl += ' NOT NULL'
+            
+            try:
+                with engine.begin() as conn:
+                    conn.execute(text(ddl))
+                added_to_table.append((table.name, column.name))
+                print(f"✅ Added column {table.name}.{column.name}")
+            except Exception as e:
+                print(f"⚠️  Could not add column {table.name}.{column.name}: {e}")
+        
+        run_column_backfills(added_to_table)
+        added_columns += added_to_table
+        
+        existing_indexes = {i['name'] for i in inspector.get_indexes(table.name)}
+        for index in table.indexes:
+            if index.name in existing_indexes:
+                continue
+            try:
+                with engine.begin() as conn:
+                    prepare = INDEX_PREPARATIONS.get(index.name)
+                    if prepare:
+                        prepare(conn)
+                    index.create(bind=conn, checkfirst=True)
+                print(f"✅ Created index {index.name}")
+            except Exception as e:
+                if index.unique:
+                    print(f"❌ Could not create unique index {index.name}: {e}")
+                    raise
+                print(f"⚠️  Could not create index {index.name}: {e}")
+    
+    return added_columns
+
+# One-off backfills for columns added to existing tables by upgrade_schema()
+COLUMN_BACKFILLS = {
+    ('users', 'active_referral_count'): """
+        UPDATE users SET active_referral_count = (
+            SELECT COUNT(*) FROM referrals
+            WHERE referrals.referrer = users.wallet
+            AND EXISTS (SELECT 1 FROM airdrop_claims WHERE airdrop_claims.wallet = referrals.referee)
+        )
+    """,
+    ('airdrop_claims', 'reward_type'): """
+        UPDATE airdrop_claims SET reward_type = CASE
+            WHEN tx_hash LIKE 'TASK_%' THEN 'task'
+            WHEN tx_hash LIKE 'STREAK_%' THEN 'streak'
+            ELSE 'airdrop'
+        END
+    """,
+}
+
+def run_column_backfills(added_columns):
+    for table_column in added_columns:
+        sql = COLUMN_BACKFILLS.get(table_column)
+        if not sql:
+            continue
+        try:
+            with db.engine.begin() as conn:
+                conn.execute(text(sql))
+            print(f"✅ Backfilled {'.'.join(table_column)}")
+        except Exception as e:
+            print(f"⚠️  Could not backfill {'.'.join(table_column)}: {e}")
+
+def retire_duplicate_airdrop_claims(conn):
+    """Keep each wallet's first airdrop claim so uq_claim_wallet_airdrop can be built.
+    
+    Later ones are double claims from before the index existed. They stay in
+    the table for audit, marked reward_type and status 'duplicate', and their
+    amounts are taken back out of wallet_balances.
+    """
+    table = AirdropClaim.__table__
+    first_claims = select(func.min(table.c.id)).where(
+        table.c.reward_type == 'airdrop'
+    ).group_by(table.c.wallet)
+    duplicates = conn.execute(
+        select(table.c.id, table.c.wallet, table.c.amount, table.c.status)
+        .where(table.c.reward_type == 'airdrop', table.c.id.not_in(first_claims))
+    ).all()
+    if not duplicates:
+        return
+    
+    conn.execute(
+        update(table)
+        .where(table.c.id.in_([claim.id for claim in duplicates]))
+        .values(reward_type='duplicate', status='duplicate')
+    )
+    
+    refunds = {}
+    for claim in duplicates:
+        if claim.status == 'completed':
+            refunds[claim.wallet] = refunds.get(claim.wallet, 0.0) + claim.amount
+    balances = WalletBalance.__table__
+    for wallet, amount in sorted(refunds.items()):
+        conn.execute(
+            update(balances)
+            .where(balances.c.wallet == wallet)
+            .values(balance=balances.c.balance - amount)
+        )
+    print(f"⚠️  Retired {len(duplicates)} duplicate airdrop claims across {len({c.wallet for c in duplicates})} wallets")
+
+# Run in the same transaction right before upgrade_schema() builds the index
+INDEX_PREPARATIONS = {
+    'uq_claim_wallet_airdrop': retire_duplicate_airdrop_claims,
+}
+
 def initialize_database():
     """Initialize database with default data"""
     with app.app_context():
@@ -713,78 +2417,9 @@ def get_all_tasks():
             'message': 'Wallet address required'
         })
     
-    user_tasks = {}
-    if wallet_address:
-        tasks = UserTask.query.filter_by(wallet=wallet_address).all()
-        for task in tasks:
-            user_tasks[task.task_id] = {
-                'status': task.status,
-                'completions': task.completions,
-                'last_completed': task.last_completed.isoformat() if task.last_completed else None,
-                'next_available': task.next_available.isoformat() if task.next_available else None
-            }
-    
-    tasks_list = []
-    for task_def in TASKS:
-        if not task_def.get('is_active', True):
-            continue
-            
-        user_task = user_tasks.get(task_def['id'], {})
-        
-        can_complete = False
-        next_available = None
-        
-        if user_task:
-            if task_def['type'] in ['daily', 'weekly']:
-                now = datetime.utcnow()
-                if user_task['next_available']:
-                    next_available_dt = datetime.fromisoformat(user_task['next_available'].replace('Z', '+00:00'))
-                    can_complete = now >= next_available_dt
-                    if not can_complete:
-                        next_available = next_available_dt.isoformat()
-                else:
-                    can_complete = True
-            else:
-                can_complete = user_task['status'] in ['pending', 'verified']
-        else:
-            can_complete = True
-        
-        tasks_list.append({
-            'id': task_def['id'],
-            'title': task_def['title'],
-            'description': task_def['description'],
-            'category': task_def['category'],
-            'type': task_def['type'],
-            'reward_apro': task_def['reward_apro'],
-            'requires_verification': task_def.get('requires_verification', False),
-            'verification_type': task_def.get('verification_type'),
-            'user_status': user_task.get('status', 'pending'),
-            'user_completions': user_task.get('completions', 0),
-            'can_complete': can_complete,
-            'next_available': next_available,
-            'max_completions': task_def.get('max_completions', 1)
-        })
-    
-    grouped_tasks = {}
-    for task in tasks_list:
-        category = task['category']
-        if category not in grouped_tasks:
-            grouped_tasks[category] = []
-        grouped_tasks[category].append(task)
-    
-    streak = DailyStreak.query.get(wallet_address)
-    streak_data = {
-        'current_streak': streak.current_streak if streak else 0,
-        'longest_streak': streak.longest_streak if streak else 0,
-        'total_checkins': streak.total_checkins if streak else 0,
-        'last_checkin': streak.last_checkin.isoformat() if streak and streak.last_checkin else None
-    }
-    
     return jsonify({
         'success': True,
-        'tasks': grouped_tasks,
-        'streak': streak_data,
-        'total_rewards_available': calculate_available_task_rewards(wallet_address)
+        **build_tasks_data(wallet_address)
     })
 
 @app.route('/api/tasks/start', methods=['POST'])
@@ -800,7 +2435,7 @@ def start_task():
             'message': 'Wallet and task ID required'
         })
     
-    task_def = next((t for t in TASKS if t['id'] == task_id), None)
+    task_def = task_catalog.get(task_id)
     if not task_def:
         return jsonify({
             'success': False,
@@ -832,6 +2467,7 @@ def start_task():
                 })
     
     db.session.commit()
+    invalidate_task_state(wallet_address)
     
     return jsonify({
         'success': True,
@@ -853,7 +2489,7 @@ def complete_task():
             'message': 'Wallet and task ID required'
         })
     
-    task_def = next((t for t in TASKS if t['id'] == task_id), None)
+    task_def = task_catalog.get(task_id)
     if not task_def:
         return jsonify({
             'success': False,
@@ -891,18 +2527,9 @@ def db_info():
     
     with app.app_context():
         try:
-            # Count records in each table
-            counts = {
-                'users': User.query.count(),
-                'airdrop_claims': AirdropClaim.query.count(),
-                'referrals': Referral.query.count(),
-                'achievements': Achievement.query.count(),
-                'notifications': Notification.query.count(),
-                'presale_transactions': PresaleTransaction.query.count(),
-                'tasks': Task.query.count(),
-                'user_tasks': UserTask.query.count(),
-                'daily_streaks': DailyStreak.query.count(),
-            }
+            # Row counts are maintained in global_stats, no table scans
+            stats = get_global_stats()
+            counts = {name: stats[name] for name in COUNTED_TABLES}
             
             return jsonify({
                 'success': True,
@@ -939,7 +2566,7 @@ def submit_verification():
             'message': 'Missing required data'
         })
     
-    task_def = next((t for t in TASKS if t['id'] == task_id), None)
+    task_def = task_catalog.get(task_id)
     if not task_def:
         return jsonify({
             'success': False,
@@ -973,17 +2600,10 @@ def submit_verification():
     user_task.status = 'pending_verification'
     user_task.verification_data = json.dumps(proof_data)
     
-    notification = Notification(
-        id=AirdropSystem.generate_notification_id(),
-        wallet=wallet_address,
-        type='task_verification',
-        message=f'✅ Verification submitted for task: {task_def["title"]}',
-        timestamp=datetime.utcnow(),
-        read=False
-    )
-    db.session.add(notification)
+    notification_writer.stage(wallet_address, 'task_verification', f'✅ Verification submitted for task: {task_def["title"]}')
     
     db.session.commit()
+    invalidate_task_state(wallet_address)
     
     return jsonify({
         'success': True,
@@ -1017,7 +2637,7 @@ def claim_task_reward():
             'message': 'Task not completed or reward already claimed'
         })
     
-    task_def = next((t for t in TASKS if t['id'] == task_id), None)
+    task_def = task_catalog.get(task_id)
     if not task_def:
         return jsonify({
             'success': False,
@@ -1036,23 +2656,17 @@ def claim_task_reward():
         referrer=None,
         tx_hash=f"TASK_{task_id}_{secrets.token_hex(8)}",
         claimed_at=datetime.utcnow(),
-        status='completed'
+        status='completed',
+        reward_type='task'
     )
     db.session.add(claim)
     
     user_task.status = 'claimed'
     
-    notification = Notification(
-        id=AirdropSystem.generate_notification_id(),
-        wallet=wallet_address,
-        type='task_reward',
-        message=f'🎉 Claimed {reward_amount} APRO for completing: {task_def["title"]}',
-        timestamp=datetime.utcnow(),
-        read=False
-    )
-    db.session.add(notification)
+    notification_writer.stage(wallet_address, 'task_reward', f'🎉 Claimed {reward_amount} APRO for completing: {task_def["title"]}')
     
     db.session.commit()
+    invalidate_task_state(wallet_address)
     
     return jsonify({
         'success': True,
@@ -1084,7 +2698,12 @@ def daily_checkin():
     
     streak = DailyStreak.query.get(wallet_address)
     if not streak:
-        streak = DailyStreak(wallet=wallet_address)
+        streak = DailyStreak(
+            wallet=wallet_address,
+            current_streak=0,
+            longest_streak=0,
+            total_checkins=0
+        )
         db.session.add(streak)
     
     if streak.last_checkin:
@@ -1110,7 +2729,7 @@ def daily_checkin():
     streak.total_checkins += 1
     streak.longest_streak = max(streak.longest_streak, streak.current_streak)
     
-    task_def = next((t for t in TASKS if t['id'] == 'daily_checkin'), None)
+    task_def = task_catalog.get('daily_checkin')
     if task_def:
         process_task_completion(wallet_address, 'daily_checkin', task_def)
     
@@ -1131,11 +2750,19 @@ def daily_checkin():
             referrer=None,
             tx_hash=f"STREAK_{streak.current_streak}_{secrets.token_hex(6)}",
             claimed_at=now,
-            status='completed'
+            status='completed',
+            reward_type='streak'
         )
         db.session.add(bonus_claim)
     
+    event_broker.stage(wallet_address, 'streak', {
+        'current': streak.current_streak,
+        'longest': streak.longest_streak,
+        'total': streak.total_checkins
+    })
+    
     db.session.commit()
+    invalidate_task_state(wallet_address)
     
     return jsonify({
         'success': True,
@@ -1150,6 +2777,90 @@ def daily_checkin():
 
 # ==================== TASK HELPER FUNCTIONS ====================
 
+def build_task_entry(task_def, user_task):
+    can_complete = False
+    next_available = None
+    
+    if user_task:
+        if task_def['type'] in ['daily', 'weekly']:
+            if user_task['next_available']:
+                can_complete = datetime.utcnow() >= user_task['next_available']
+                if not can_complete:
+                    next_available = user_task['next_available'].isoformat()
+            else:
+                can_complete = True
+        else:
+            can_complete = user_task['status'] in ['pending', 'verified']
+    else:
+        can_complete = True
+    
+    return {
+        'id': task_def['id'],
+        'title': task_def['title'],
+        'description': task_def['description'],
+        'category': task_def['category'],
+        'type': task_def['type'],
+        'reward_apro': task_def['reward_apro'],
+        'requires_verification': task_def.get('requires_verification', False),
+        'verification_type': task_def.get('verification_type'),
+        'user_status': user_task.get('status', 'pending'),
+        'user_completions': user_task.get('completions', 0),
+        'can_complete': can_complete,
+        'next_available': next_available,
+        'max_completions': task_def.get('max_completions', 1)
+    }
+
+# Raw per-wallet task rows, cached per worker. Everything time-dependent
+# (can_complete, next_available) is derived from it on each read, and every
+# endpoint that writes UserTask or DailyStreak drops the wallet's entry.
+task_state_cache = TTLCache(maxsize=10000, ttl=TASK_STATE_CACHE_SECONDS)
+
+def load_task_state(wallet_address):
+    state = task_state_cache.get(wallet_address)
+    if state is not None:
+        return state
+    
+    user_tasks = {}
+    for task in UserTask.query.filter_by(wallet=wallet_address):
+        user_tasks[task.task_id] = {
+            'status': task.status,
+            'completions': task.completions,
+            'next_available': task.next_available
+        }
+    
+    streak = DailyStreak.query.get(wallet_address)
+    state = {
+        'user_tasks': user_tasks,
+        'streak': {
+            'current_streak': streak.current_streak if streak else 0,
+            'longest_streak': streak.longest_streak if streak else 0,
+            'total_checkins': streak.total_checkins if streak else 0,
+            'last_checkin': streak.last_checkin.isoformat() if streak and streak.last_checkin else None
+        }
+    }
+    task_state_cache.set(wallet_address, state)
+    return state
+
+def invalidate_task_state(wallet_address):
+    task_state_cache.pop(wallet_address)
+
+def build_tasks_data(wallet_address):
+    state = load_task_state(wallet_address)
+    user_tasks = state['user_tasks']
+    
+    grouped_tasks = {}
+    for category, task_defs in task_catalog.active_by_category().items():
+        grouped_tasks[category] = [
+            build_task_entry(task_def, user_tasks.get(task_def['id'], {}))
+            for task_def in task_defs
+        ]
+    
+    return {
+        'tasks': grouped_tasks,
+        'streak': dict(state['streak']),
+        'total_rewards_available': calculate_available_task_rewards(user_tasks)
+    }
+
 def process_task_completion(wallet_address, task_id, task_def):
     user_task = UserTask.query.filter_by(wallet=wallet_address, task_id=task_id).first()
     if not user_task:
@@ -1172,17 +2883,12 @@ def process_task_completion(wallet_address, task_id, task_def):
     else:
         user_task.next_available = None
     
-    notification = Notification(
-        id=AirdropSystem.generate_notification_id(),
-        wallet=wallet_address,
-        type='task_complete',
-        message=f'✅ Task completed: {task_def["title"]}! Earned {task_def["reward_apro"]} APRO',
-        timestamp=datetime.utcnow(),
-        read=False
-    )
-    db.session.add(notification)
+    notification_writer.stage(wallet_address, 'task_complete', f'✅ Task completed: {task_def["title"]}! Earned {task_def["reward_apro"]} APRO')
+    
+    achievement_engine.on_event(wallet_address, 'task_completion')
     
     db.session.commit()
+    invalidate_task_state(wallet_address)
     
     return jsonify({
         'success': True,
@@ -1192,15 +2898,12 @@ def process_task_completion(wallet_address, task_id, task_def):
         'next_available': user_task.next_available.isoformat() if user_task.next_available else None
     })
 
-def calculate_available_task_rewards(wallet_address):
-    user_tasks = UserTask.query.filter_by(
-        wallet=wallet_address,
-        status='completed'
-    ).all()
-    
+def calculate_available_task_rewards(user_tasks):
     total_rewards = 0
-    for user_task in user_tasks:
-        task_def = next((t for t in TASKS if t['id'] == user_task.task_id), None)
+    for task_id, user_task in user_tasks.items():
+        if user_task['status'] != 'completed':
+            continue
+        task_def = task_catalog.get(task_id)
         if task_def:
             total_rewards += task_def['reward_apro']
     
@@ -1245,17 +2948,12 @@ def admin_verify_task():
         if user_task:
             user_task.status = 'completed'
             
-            notification = Notification(
-                id=AirdropSystem.generate_notification_id(),
-                wallet=verification.wallet,
-                type='task_approved',
-                message=f'✅ Your task verification was approved!',
-                timestamp=datetime.utcnow(),
-                read=False
-            )
-            db.session.add(notification)
+            notification_writer.stage(verification.wallet, 'task_approved', f'✅ Your task verification was approved!')
+            
+            achievement_engine.on_event(verification.wallet, 'task_completion')
     
     db.session.commit()
+    invalidate_task_state(verification.wallet)
     
     return jsonify({
         'success': True,
@@ -1280,7 +2978,7 @@ def get_pending_verifications():
     
     verifications = []
     for v in pending:
-        task_def = next((t for t in TASKS if t['id'] == v.task_id), None)
+        task_def = task_catalog.get(v.task_id)
         
         verifications.append({
             'id': v.id,
@@ -1299,6 +2997,26 @@ def get_pending_verifications():
         'verifications': verifications
     })
 
+@app.route('/api/admin/tasks/reload-catalog', methods=['POST'])
+def reload_task_catalog():
+    data = request.json or {}
+    if data.get('admin_key', '') != ADMIN_API_KEY:
+        return jsonify({
+            'success': False,
+            'error': 'Unauthorized'
+        }), 401
+    
+    version = task_catalog.bump_version()
+    db.session.commit()
+    task_catalog.reload(str(version))
+    
+    return jsonify({
+        'success': True,
+        'message': 'Task catalog reloaded',
+        'version': version,
+        'active_tasks': len(task_catalog.active_tasks())
+    })
+
 # ==================== WEB3 PRESALE TRANSACTION ENDPOINTS ====================
 
 @app.route('/api/transaction', methods=['POST'])
@@ -1363,15 +3081,7 @@ def record_transaction():
             )
             db.session.add(user)
         
-        notification = Notification(
-            id=AirdropSystem.generate_notification_id(),
-            wallet=wallet_address,
-            type='presale',
-            message=f'✅ Presale contribution confirmed! ${float(data["usd_amount"]):.2f} USD via {data["token_name"]}',
-            timestamp=datetime.utcnow(),
-            read=False
-        )
-        db.session.add(notification)
+        notification_writer.stage(wallet_address, 'presale', f'✅ Presale contribution confirmed! ${float(data["usd_amount"]):.2f} USD via {data["token_name"]}')
         
         db.session.commit()
         
@@ -1460,6 +3170,110 @@ def get_user_transactions(wallet_address):
             'error': str(e)
         }), 500
 
+# ==================== WALLET VIEW BUILDERS ====================
+# Shared by the single-purpose endpoints and /api/dashboard. Callers pass in
+# the rows they already loaded so the dashboard can reuse them across sections.
+
+def build_claim_data(user, claim, achievement_rewards):
+    current_referral_count = user.referral_count if user else 0
+    
+    return {
+        'amount': AirdropSystem.calculate_airdrop_amount(current_referral_count, float(achievement_rewards)),
+        'base_amount': 1005.0,
+        'referral_bonus': current_referral_count * 121,
+        'achievement_rewards': float(achievement_rewards),
+        'referral_count': current_referral_count,
+        'tx_hash': claim.tx_hash,
+        'timestamp': claim.claimed_at.isoformat(),
+        'referrer': claim.referrer
+    }
+
+def build_referral_stats(user):
+    conversion_rate = 0
+    if user.link_clicks > 0:
+        conversion_rate = round((user.link_conversions / user.link_clicks) * 100, 1)
+    
+    return {
+        'referral_count': user.referral_count,
+        'link_clicks': user.link_clicks,
+        'link_conversions': user.link_conversions,
+        'conversion_rate': conversion_rate,
+        'total_bonus': user.referral_count * 121,
+        'referral_code': user.referral_code,
+        'is_active': user.active
+    }
+
+def build_withdrawal_status(user):
+    eligibility = get_withdrawal_eligibility(user)
+    
+    return {
+        **eligibility,
+        'message': 'Eligible for withdrawal' if eligibility['is_eligible'] else f"Need {eligibility['remaining_needed']} more active referrals"
+    }
+
+def build_network_analysis(user, achievement_rewards, depth):
+    wallet_address = user.wallet
+    depth = max(1, min(depth, NETWORK_MAX_DEPTH))
+    
+    direct_referrals_count = Referral.query.filter_by(referrer=wallet_address).count()
+    
+    eligibility = get_withdrawal_eligibility(user)
+    active_referrals_count = eligibility['referral_count']
+    
+    inactive_referrals_count = direct_referrals_count - active_referrals_count
+    
+    total_amount = 1005.0 + (user.referral_count * 121) + achievement_rewards
+    
+    can_withdraw = eligibility['is_eligible']
+    available_for_withdrawal = total_amount if can_withdraw else 0
+    
+    network = ReferralNetwork.query.get(wallet_address)
+    
+    return {
+        'direct_referrals_count': direct_referrals_count,
+        'active_referrals_count': active_referrals_count,
+        'inactive_referrals_count': inactive_referrals_count,
+        'total_amount': total_amount,
+        'can_withdraw': can_withdraw,
+        'available_for_withdrawal': available_for_withdrawal,
+        'withdrawal_message': f"Need {eligibility['remaining_needed']} more active referrals to withdraw" if not can_withdraw else 'Eligible for withdrawal',
+        'network': {
+            'depth': depth,
+            'levels': get_network_levels(wallet_address, depth),
+            'downline_size': network.downline_size if network else 0,
+            'active_downline': network.active_downline if network else 0
+        }
+    }
+
+def build_achievements_data(user, unlocked_ids):
+    achievements_list = []
+    total_unlocked = 0
+    total_rewards = 0
+    
+    for achievement_def in ACHIEVEMENTS:
+        unlocked = achievement_def['id'] in unlocked_ids
+        if unlocked:
+            total_unlocked += 1
+            total_rewards += achievement_def['reward']
+        
+        achievements_list.append({
+            'id': achievement_def['id'],
+            'name': achievement_def['name'],
+            'icon': achievement_def['icon'],
+            'requirement': achievement_def['requirement'],
+            'reward': achievement_def['reward'],
+            'unlocked': unlocked,
+            'description': f"Earn {achievement_def['reward']} APRO bonus for {achievement_def['name'].lower()}"
+        })
+    
+    return {
+        'achievements': achievements_list,
+        'total_unlocked': total_unlocked,
+        'total_rewards': total_rewards,
+        'referral_count': user.referral_count,
+        'progress_percentage': round((total_unlocked / len(ACHIEVEMENTS)) * 100)
+    }
+
 # ==================== WITHDRAWAL ENDPOINTS ====================
 
 @app.route('/api/check-withdrawal-eligibility', methods=['GET'])
@@ -1473,22 +3287,9 @@ def check_withdrawal_eligibility():
     if not user:
         return jsonify({'success': False, 'message': 'User not found'})
     
-    direct_referrals = Referral.query.filter_by(referrer=wallet_address).all()
-    active_referrals_count = 0
-    for referral in direct_referrals:
-        claim = AirdropClaim.query.filter_by(wallet=referral.referee).first()
-        if claim:
-            active_referrals_count += 1
-    
-    is_eligible = active_referrals_count >= 7
-    
     return jsonify({
         'success': True,
-        'is_eligible': is_eligible,
-        'referral_count': active_referrals_count,
-        'required_count': 7,
-        'remaining_needed': max(0, 7 - active_referrals_count),
-        'message': 'Eligible for withdrawal' if is_eligible else f'Need {7 - active_referrals_count} more active referrals'
+        **build_withdrawal_status(user)
     })
 
 @app.route('/api/simulate-withdrawal', methods=['POST'])
@@ -1504,17 +3305,13 @@ def simulate_withdrawal():
     if not user:
         return jsonify({'success': False, 'message': 'User not found'})
     
-    direct_referrals = Referral.query.filter_by(referrer=wallet_address).all()
-    active_referrals_count = 0
-    for referral in direct_referrals:
-        claim = AirdropClaim.query.filter_by(wallet=referral.referee).first()
-        if claim:
-            active_referrals_count += 1
+    eligibility = get_withdrawal_eligibility(user)
+    active_referrals_count = eligibility['referral_count']
     
     withdrawal_attempt = WithdrawalAttempt(
         wallet=wallet_address,
         referral_count=active_referrals_count,
-        eligible=(active_referrals_count >= 7),
+        eligible=eligibility['is_eligible'],
         attempted_at=datetime.utcnow(),
         status='checked',
         notes='User checked withdrawal eligibility'
@@ -1522,13 +3319,13 @@ def simulate_withdrawal():
     db.session.add(withdrawal_attempt)
     db.session.commit()
     
-    if active_referrals_count < 7:
+    if not eligibility['is_eligible']:
         return jsonify({
             'success': True,
             'is_eligible': False,
             'referral_count': active_referrals_count,
-            'required_count': 7,
-            'remaining_needed': 7 - active_referrals_count,
+            'required_count': eligibility['required_count'],
+            'remaining_needed': eligibility['remaining_needed'],
             'message': '❌ You are not yet eligible for withdrawals. Ensure you invite at least 7 friends or more to be eligible to withdraw ✨',
             'progress_message': f'📈 Progress to Unlock Withdrawals\nYou need {7 - active_referrals_count} more referrals to unlock withdrawal access.\nInvite friends now to secure your airdrop position!\nCurrent Referrals: [{active_referrals_count}/7]'
         })
@@ -1561,21 +3358,9 @@ def get_referral_stats():
             'message': 'User not found'
         })
     
-    conversion_rate = 0
-    if user.link_clicks > 0:
-        conversion_rate = round((user.link_conversions / user.link_clicks) * 100, 1)
-    
     return jsonify({
         'success': True,
-        'data': {
-            'referral_count': user.referral_count,
-            'link_clicks': user.link_clicks,
-            'link_conversions': user.link_conversions,
-            'conversion_rate': conversion_rate,
-            'total_bonus': user.referral_count * 121,
-            'referral_code': user.referral_code,
-            'is_active': user.active
-        }
+        'data': build_referral_stats(user)
     })
 
 @app.route('/api/get-network-analysis', methods=['GET'])
@@ -1595,33 +3380,14 @@ def get_network_analysis():
             'message': 'User not found'
         })
     
-    direct_referrals = Referral.query.filter_by(referrer=wallet_address).all()
-    direct_referrals_count = len(direct_referrals)
-    
-    active_referrals_count = 0
-    for referral in direct_referrals:
-        claim = AirdropClaim.query.filter_by(wallet=referral.referee).first()
-        if claim:
-            active_referrals_count += 1
-    
-    inactive_referrals_count = direct_referrals_count - active_referrals_count
-    
-    total_amount = 1005.0 + (user.referral_count * 121) + calculate_achievement_rewards(wallet_address)
-    
-    can_withdraw = active_referrals_count >= 7
-    available_for_withdrawal = total_amount if can_withdraw else 0
+    try:
+        depth = int(request.args.get('depth', NETWORK_DEFAULT_DEPTH))
+    except ValueError:
+        depth = NETWORK_DEFAULT_DEPTH
     
     return jsonify({
         'success': True,
-        'data': {
-            'direct_referrals_count': direct_referrals_count,
-            'active_referrals_count': active_referrals_count,
-            'inactive_referrals_count': inactive_referrals_count,
-            'total_amount': total_amount,
-            'can_withdraw': can_withdraw,
-            'available_for_withdrawal': available_for_withdrawal,
-            'withdrawal_message': f'Need {7 - active_referrals_count} more active referrals to withdraw' if not can_withdraw else 'Eligible for withdrawal'
-        }
+        'data': build_network_analysis(user, calculate_achievement_rewards(wallet_address), depth)
     })
 
 @app.route('/api/get-achievements', methods=['GET'])
@@ -1641,38 +3407,9 @@ def get_achievements():
             'message': 'User not found'
         })
     
-    unlocked_achievements = Achievement.query.filter_by(wallet=wallet_address).all()
-    unlocked_ids = [a.achievement_id for a in unlocked_achievements]
-    
-    achievements_list = []
-    total_unlocked = 0
-    total_rewards = 0
-    
-    for achievement_def in ACHIEVEMENTS:
-        unlocked = achievement_def['id'] in unlocked_ids
-        if unlocked:
-            total_unlocked += 1
-            total_rewards += achievement_def['reward']
-        
-        achievements_list.append({
-            'id': achievement_def['id'],
-            'name': achievement_def['name'],
-            'icon': achievement_def['icon'],
-            'requirement': achievement_def['requirement'],
-            'reward': achievement_def['reward'],
-            'unlocked': unlocked,
-            'description': f"Earn {achievement_def['reward']} APRO bonus for {achievement_def['name'].lower()}"
-        })
-    
     return jsonify({
         'success': True,
-        'data': {
-            'achievements': achievements_list,
-            'total_unlocked': total_unlocked,
-            'total_rewards': total_rewards,
-            'referral_count': user.referral_count,
-            'progress_percentage': round((total_unlocked / len(ACHIEVEMENTS)) * 100)
-        }
+        'data': build_achievements_data(user, get_unlocked_achievement_ids(wallet_address))
     })
 
 @app.route('/api/track-link-click', methods=['POST'])
@@ -1687,22 +3424,20 @@ def track_link_click():
             'message': 'Referral code is required'
         })
     
-    user = User.query.filter_by(referral_code=referral_code).first()
-    if not user:
+    # Checked against users only when the buffer is flushed; unknown codes match no row
+    if len(referral_code) > 20 or not all(c.isalnum() or c == '-' for c in referral_code):
         return jsonify({
             'success': False,
             'message': 'Invalid referral code'
         })
     
-    user.link_clicks += 1
-    db.session.commit()
+    link_click_buffer.record(referral_code)
     
     return jsonify({
         'success': True,
         'message': 'Link click tracked',
         'data': {
-            'referral_code': referral_code,
-            'total_clicks': user.link_clicks
+            'referral_code': referral_code
         }
     })
 
@@ -1714,37 +3449,12 @@ def get_total_balance():
     if not wallet_address:
         return jsonify({'success': False, 'message': 'Wallet required'})
     
-    total = 0
-    
-    # 1. Original airdrop claim
-    claim = AirdropClaim.query.filter_by(wallet=wallet_address, status='completed').first()
-    if claim:
-        total += claim.amount
-    
-    # 2. Task rewards (claimed)
-    task_claims = AirdropClaim.query.filter(
-        AirdropClaim.wallet == wallet_address,
-        AirdropClaim.tx_hash.like('TASK_%')
-    ).all()
-    for tc in task_claims:
-        total += tc.amount
-    
-    # 3. Streak bonuses (claimed)
-    streak_claims = AirdropClaim.query.filter(
-        AirdropClaim.wallet == wallet_address,
-        AirdropClaim.tx_hash.like('STREAK_%')
-    ).all()
-    for sc in streak_claims:
-        total += sc.amount
+    breakdown = get_balance_breakdown(wallet_address)
     
     return jsonify({
         'success': True,
-        'total_balance': total,
-        'breakdown': {
-            'airdrop': claim.amount if claim else 0,
-            'task_rewards': sum(tc.amount for tc in task_claims),
-            'streak_bonuses': sum(sc.amount for sc in streak_claims)
-        }
+        'total_balance': get_wallet_balance(wallet_address),
+        'breakdown': {key: breakdown[reward_type] for reward_type, key in BALANCE_BREAKDOWN_KEYS.items()}
     })
 
 @app.route('/api/get-notifications', methods=['GET'])
@@ -1757,12 +3467,27 @@ def get_notifications():
             'message': 'Wallet address is required'
         })
     
-    notifications = Notification.query.filter_by(wallet=wallet_address)\
-        .order_by(Notification.timestamp.desc())\
-        .limit(50)\
+    limit = min(max(request.args.get('limit', NOTIFICATION_PAGE_SIZE, type=int), 1), MAX_NOTIFICATION_PAGE_SIZE)
+    
+    query = Notification.query.filter_by(wallet=wallet_address)
+    
+    before = request.args.get('before', '').strip()
+    if before:
+        try:
+            before_timestamp, before_id = decode_notification_cursor(before)
+        except ValueError:
+            return jsonify({
+                'success': False,
+                'message': 'Invalid cursor'
+            })
+        query = query.filter(notifications_before(before_timestamp, before_id))
+    
+    notifications = query.order_by(Notification.timestamp.desc(), Notification.id.desc())\
+        .limit(limit + 1)\
         .all()
     
-    unread_count = Notification.query.filter_by(wallet=wallet_address, read=False).count()
+    has_more = len(notifications) > limit
+    notifications = notifications[:limit]
     
     return jsonify({
         'success': True,
@@ -1774,8 +3499,10 @@ def get_notifications():
                 'timestamp': n.timestamp.isoformat(),
                 'read': n.read
             } for n in notifications],
-            'unread_count': unread_count,
-            'total_count': len(notifications)
+            'unread_count': get_unread_count(wallet_address),
+            'total_count': len(notifications),
+            'has_more': has_more,
+            'next_cursor': encode_notification_cursor(notifications[-1]) if has_more else None
         }
     })
 
@@ -1791,19 +3518,72 @@ def mark_notification_read():
             'message': 'Notification ID is required'
         })
     
-    notification = Notification.query.get(notification_id)
-    if not notification:
+    if not mark_notifications_read([notification_id]):
+        # Nothing flipped: either already read or not there at all
+        if not db.session.query(Notification.query.filter_by(id=notification_id).exists()).scalar():
+            return jsonify({
+                'success': False,
+                'message': 'Notification not found'
+            })
+    db.session.commit()
+    
+    return jsonify({
+        'success': True,
+        'message': 'Notification marked as read'
+    })
+
+@app.route('/api/mark-notifications-read', methods=['POST'])
+@limiter.limit("20 per minute")
+def mark_notifications_read_bulk():
+    data = request.json or {}
+    wallet_address = data.get('wallet', '').strip().lower()
+    notification_ids = data.get('notification_ids')
+    mark_all = bool(data.get('all'))
+    
+    if not wallet_address:
+        return jsonify({
+            'success': False,
+            'message': 'Wallet address is required'
+        })
+    
+    if mark_all == (notification_ids is not None):
         return jsonify({
             'success': False,
-            'message': 'Notification not found'
+            'message': 'Provide either notification_ids or all=true'
         })
     
-    notification.read = True
+    if notification_ids is not None:
+        if not isinstance(notification_ids, list) or not all(isinstance(i, str) for i in notification_ids):
+            return jsonify({
+                'success': False,
+                'message': 'notification_ids must be a list of ids'
+            })
+        if len(notification_ids) > MAX_MARK_READ_IDS:
+            return jsonify({
+                'success': False,
+                'message': f'At most {MAX_MARK_READ_IDS} ids per request'
+            })
+    
+    before = None
+    if mark_all and data.get('before'):
+        try:
+            before = decode_notification_cursor(str(data['before']))
+        except ValueError:
+            return jsonify({
+                'success': False,
+                'message': 'Invalid cursor'
+            })
+    
+    marked = 0
+    if notification_ids != []:
+        marked = mark_notifications_read(notification_ids, wallet_address=wallet_address, before=before)
     db.session.commit()
     
     return jsonify({
         'success': True,
-        'message': 'Notification marked as read'
+        'message': f'{marked} notifications marked as read',
+        'marked': marked,
+        'unread_count': get_unread_count(wallet_address)
     })
 
 # ==================== PRESALE ENDPOINTS ====================
@@ -1890,37 +3670,421 @@ def get_presale_contributions():
         }
     })
 
-# ==================== EXISTING AIRDROP ENDPOINTS ====================
+# ==================== TOKEN BUCKETS ====================
 
-@app.route('/')
-def index():
-    return render_template('index.html')
+# Claim-path limits per wallet: (burst, tokens refilled per second). They
+# stop one wallet rotating through IPs, which the route's flask-limiter
+# limits (keyed on wallet + IP, plus a loose per-IP ceiling for shared
+# NAT addresses) cannot see.
+TOKEN_BUCKET_RULES = {
+    'check_wallet': (5, 10 / 60),
+    'claim_airdrop': (3, 5 / 60),
+}
 
-@app.before_request
-def check_ip_restriction():
-    if request.endpoint in ['check_wallet', 'claim_airdrop']:
-        ip_address = get_remote_address()
-        
-        wallet_address = None
-        if request.is_json:
-            data = request.get_json(silent=True) or {}
-            wallet_address = data.get('wallet_address', '').strip().lower()
-        
-        if wallet_address == ADMIN_WALLET.lower():
-            return
+class TokenBuckets:
+    """Thread-safe in-memory token buckets, least recently used evicted past maxsize"""
+    
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+    
+    def take(self, limits):
+        """Spend one token from every (key, burst, rate) bucket, or from none.
         
-        restriction = IPRestriction.query.filter_by(ip_address=ip_address).first()
+        Returns 0 when the request is allowed, otherwise the seconds until
+        every bucket holds a token again.
+        """
+        now = time.monotonic()
+        with self._lock:
+            levels = []
+            for key, burst, rate in limits:
+                tokens, stamp = self._buckets.get(key, (burst, now))
+                levels.append(min(burst, tokens + (now - stamp) * rate))
+            
+            retry_after = max((1 - tokens) / rate for tokens, (_, _, rate) in zip(levels, limits))
+            spend = 0 if retry_after > 0 else 1
+            
+            for tokens, (key, _, _) in zip(levels, limits):
+                self._buckets[key] = (tokens - spend, now)
+                self._buckets.move_to_end(key)
+            while len(self._buckets) > self.maxsize:
+                self._buckets.popitem(last=False)
+            
+            return max(retry_after, 0)
+    
+    def clear(self):
+        with self._lock:
+            self._buckets.clear()
+
+token_buckets = TokenBuckets(TOKEN_BUCKET_MAX_KEYS)
+
+def get_request_wallet():
+    """Normalized wallet_address from the JSON body, or None when missing or invalid"""
+    data = request.get_json(silent=True) if request.is_json else None
+    wallet_address = data.get('wallet_address') if isinstance(data, dict) else None
+    if not isinstance(wallet_address, str):
+        return None
+    is_valid, wallet = AirdropSystem.validate_wallet_address(wallet_address)
+    return wallet if is_valid else None
+
+def get_wallet_and_address():
+    """flask-limiter key: wallet + IP, so wallets behind one NAT address get separate budgets"""
+    wallet = get_request_wallet()
+    remote_address = get_remote_address()
+    return f'{wallet}@{remote_address}' if wallet else remote_address
+
+def check_token_buckets():
+    """Reject claim-path floods from memory, before any database or limiter storage work"""
+    rule = TOKEN_BUCKET_RULES.get(request.endpoint)
+    if not rule:
+        return
+    
+    wallet = get_request_wallet()
+    if not wallet or wallet == ADMIN_WALLET.lower():
+        return
+    
+    retry_after = token_buckets.take([(('wallet', request.endpoint, wallet),) + rule])
+    if retry_after:
+        response = jsonify({
+            'success': False,
+            'message': 'Too many requests. Please wait a moment and try again.'
+        })
+        response.headers['Retry-After'] = str(ceil(retry_after))
+        return response, 429
+
+# Ahead of flask-limiter's own before_request hook, so a flood is turned away
+# from memory before it costs a round trip to the shared limiter storage
+app.before_request_funcs.setdefault(None, []).insert(0, check_token_buckets)
+
+# ==================== IP RESTRICTIONS ====================
+
+# Per-worker snapshots of ip_restrictions rows. Writes in this worker refresh
+# the entry from the values they commit; other workers see them within
+# IP_RESTRICTION_CACHE_SECONDS.
+ip_restriction_cache = TTLCache(maxsize=IP_RESTRICTION_CACHE_SIZE, ttl=IP_RESTRICTION_CACHE_SECONDS)
+
+NO_IP_RESTRICTION = {'wallet_count': 0, 'banned_until': None}
+
+def get_ip_restriction(ip_address):
+    """Return {'wallet_count', 'banned_until'} for an IP, read at most once per request"""
+    if 'ip_restrictions' not in g:
+        g.ip_restrictions = {}
+    if ip_address in g.ip_restrictions:
+        return g.ip_restrictions[ip_address]
+    
+    state = ip_restriction_cache.get(ip_address)
+    if state is None:
+        row = db.session.query(IPRestriction.wallet_count, IPRestriction.banned_until)\
+            .filter(IPRestriction.ip_address == ip_address).first()
+        state = {'wallet_count': row.wallet_count, 'banned_until': row.banned_until} if row else NO_IP_RESTRICTION
+        ip_restriction_cache.set(ip_address, state)
+    
+    g.ip_restrictions[ip_address] = state
+    return state
+
+def cache_ip_restriction(ip_address, state):
+    """Call after committing a change to the IP's row"""
+    ip_restriction_cache.set(ip_address, state)
+    if 'ip_restrictions' in g:
+        g.ip_restrictions[ip_address] = state
+
+def ban_ip(ip_address, banned_until):
+    db.session.execute(
+        update(IPRestriction.__table__)
+        .where(IPRestriction.ip_address == ip_address)
+        .values(banned_until=banned_until)
+    )
+    db.session.commit()
+    cache_ip_restriction(ip_address, dict(get_ip_restriction(ip_address), banned_until=banned_until))
+
+def count_wallet_for_ip(ip_address):
+    """Add one wallet to the IP's row in the current transaction and return the new state.
+    
+    The caller commits and then passes the state to cache_ip_restriction.
+    """
+    now = datetime.utcnow()
+    row = db.session.execute(
+        update(IPRestriction.__table__)
+        .where(IPRestriction.ip_address == ip_address)
+        .values(wallet_count=IPRestriction.wallet_count + 1, last_wallet_created=now)
+        .returning(IPRestriction.wallet_count, IPRestriction.banned_until)
+    ).first()
+    if row:
+        return {'wallet_count': row.wallet_count, 'banned_until': row.banned_until}
+    
+    db.session.add(IPRestriction(ip_address=ip_address, wallet_count=1, last_wallet_created=now))
+    return {'wallet_count': 1, 'banned_until': None}
+
+# ==================== IP RANGE RESTRICTIONS ====================
+
+IP_RANGES_VERSION_KEY = 'ip_ranges_version'
+
+def parse_ip(ip_address):
+    address = ipaddress.ip_address(ip_address)
+    if address.version == 6 and address.ipv4_mapped:
+        address = address.ipv4_mapped
+    return address
+
+def ip_prefix(ip_address):
+    """The /24 (IPv4) or /64 (IPv6) network an address is counted against"""
+    address = parse_ip(ip_address)
+    return ipaddress.ip_network(f"{address}/{24 if address.version == 4 else 64}", strict=False)
+
+class PrefixTree:
+    """Binary radix trie over address bits, one root per IP version.
+    
+    Lookups walk at most 32 (IPv4) or 128 (IPv6) nodes and return every
+    stored network containing the address, shortest prefix first.
+    """
+    
+    def __init__(self):
+        # Each node is [zero_child, one_child, value]
+        self._roots = {4: [None, None, None], 6: [None, None, None]}
+    
+    def _walk(self, network, create):
+        node = self._roots[network.version]
+        bits = int(network.network_address)
+        width = network.max_prefixlen
+        for depth in range(network.prefixlen):
+            bit = (bits >> (width - 1 - depth)) & 1
+            if node[bit] is None:
+                if not create:
+                    return None
+                node[bit] = [None, None, None]
+            node = node[bit]
+        return node
+    
+    def insert(self, network, value):
+        self._walk(network, create=True)[2] = value
+    
+    def remove(self, network):
+        node = self._walk(network, create=False)
+        if node is not None:
+            node[2] = None
+    
+    def matches(self, address):
+        node = self._roots[address.version]
+        bits = int(address)
+        width = address.max_prefixlen
+        found = []
+        for depth in range(width + 1):
+            if node[2] is not None:
+                found.append(node[2])
+            if depth == width:
+                break
+            node = node[(bits >> (width - 1 - depth)) & 1]
+            if node is None:
+                break
+        return found
+
+class IPRangeIndex:
+    """Active ip_range_restrictions rows held in a PrefixTree.
+    
+    Every change to a range stamps it with a fresh IP_RANGES_VERSION_KEY
+    version. Each worker re-reads the version at most every
+    IP_RANGE_CHECK_SECONDS and applies only the rows stamped since its last
+    sync, so a change costs one small query per worker instead of a rebuild.
+    """
+    
+    def __init__(self, check_seconds):
+        self.check_seconds = check_seconds
+        self.version = None
+        self._lock = threading.Lock()
+        self._checked_at = 0.0
+        self._tree = PrefixTree()
+    
+    def apply(self, ranges):
+        for ip_range in ranges:
+            network = ipaddress.ip_network(ip_range.cidr)
+            if ip_range.is_active:
+                self._tree.insert(network, {
+                    'cidr': ip_range.cidr,
+                    'max_wallets': ip_range.max_wallets,
+                    'banned_until': ip_range.banned_until
+                })
+            else:
+                self._tree.remove(network)
+    
+    def _ensure_fresh(self):
+        if self.version is not None and time.monotonic() - self._checked_at < self.check_seconds:
+            return
+        
+        with self._lock:
+            if self.version is not None and time.monotonic() - self._checked_at < self.check_seconds:
+                return
+            try:
+                version = int(get_system_state(IP_RANGES_VERSION_KEY, 0))
+                if self.version is None or version > self.version:
+                    # Unstamped rows are automatic prefixes that were never banned
+                    since = self.version or 0
+                    self.apply(IPRangeRestriction.query.filter(IPRangeRestriction.revision > since).all())
+                    self.version = version
+            except Exception as e:
+                db.session.rollback()
+                print(f"⚠️  Could not refresh IP ranges: {e}")
+            self._checked_at = time.monotonic()
+    
+    def matching(self, ip_address):
+        self._ensure_fresh()
+        try:
+            return self._tree.matches(parse_ip(ip_address))
+        except ValueError:
+            return []
+    
+    def banned_range(self, ip_address):
+        now = datetime.utcnow()
+        for ip_range in self.matching(ip_address):
+            if ip_range['banned_until'] and now < ip_range['banned_until']:
+                return ip_range
+        return None
+
+ip_ranges = IPRangeIndex(IP_RANGE_CHECK_SECONDS)
+
+def stamp_range_changes(ranges):
+    """Give changed ranges a new version in the current transaction; the caller commits and then applies them"""
+    version = next_system_version(IP_RANGES_VERSION_KEY)
+    for ip_range in ranges:
+        ip_range.revision = version
+    return version
+
+def count_wallet_for_ranges(ip_address):
+    """Add one wallet to every range containing the IP and ban the ones that reach their limit.
+    
+    Runs in the caller's transaction. Returns the ranges that were banned,
+    which the caller hands to ip_ranges.apply() after committing.
+    """
+    try:
+        cidrs = {ip_range['cidr']: None for ip_range in ip_ranges.matching(ip_address)}
+        if IP_PREFIX_MAX_WALLETS > 0:
+            cidrs.setdefault(str(ip_prefix(ip_address)), IP_PREFIX_MAX_WALLETS)
+    except ValueError:
+        return []
+    if not cidrs:
+        return []
+    
+    # Configured ranges already have rows; the automatic /24 or /64 row is created on first use
+    insert = postgresql_insert if is_postgresql() else sqlite_insert
+    table = IPRangeRestriction.__table__
+    stmt = insert(table).values([
+        {'cidr': cidr, 'wallet_count': 1, 'max_wallets': max_wallets or 0, 'created_at': datetime.utcnow()}
+        for cidr, max_wallets in cidrs.items()
+    ])
+    stmt = stmt.on_conflict_do_update(
+        index_elements=['cidr'],
+        set_={'wallet_count': table.c.wallet_count + 1}
+    ).returning(table.c.id, table.c.wallet_count, table.c.max_wallets, table.c.is_active)
+    
+    full = [
+        row.id for row in db.session.execute(stmt)
+        if row.is_active and row.max_wallets and row.wallet_count >= row.max_wallets
+    ]
+    if not full:
+        return []
+    
+    banned = IPRangeRestriction.query.filter(IPRangeRestriction.id.in_(full)).all()
+    for ip_range in banned:
+        ip_range.banned_until = datetime.utcnow() + timedelta(hours=IP_BAN_HOURS)
+    stamp_range_changes(banned)
+    return banned
+
+@app.route('/api/admin/ip-ranges', methods=['GET'])
+def list_ip_ranges():
+    admin_key = request.args.get('admin_key', '')
+    if admin_key != ADMIN_API_KEY:
+        return jsonify({
+            'success': False,
+            'error': 'Unauthorized'
+        }), 401
+    
+    ranges = IPRangeRestriction.query.filter_by(is_active=True)\
+        .order_by(IPRangeRestriction.wallet_count.desc())\
+        .limit(500)\
+        .all()
+    
+    return jsonify({
+        'success': True,
+        'ranges': [r.to_dict() for r in ranges]
+    })
+
+@app.route('/api/admin/ip-ranges', methods=['POST'])
+def save_ip_range():
+    data = request.json or {}
+    if data.get('admin_key', '') != ADMIN_API_KEY:
+        return jsonify({
+            'success': False,
+            'error': 'Unauthorized'
+        }), 401
+    
+    try:
+        cidr = str(ipaddress.ip_network(str(data.get('cidr', '')).strip(), strict=False))
+        max_wallets = int(data.get('max_wallets', MAX_WALLETS_PER_IP))
+        ban_hours = float(data.get('ban_hours', 0))
+    except ValueError as e:
+        return jsonify({
+            'success': False,
+            'message': f'Invalid range: {e}'
+        })
+    
+    ip_range = IPRangeRestriction.query.filter_by(cidr=cidr).first()
+    if not ip_range:
+        ip_range = IPRangeRestriction(cidr=cidr, wallet_count=0)
+        db.session.add(ip_range)
+    
+    ip_range.max_wallets = max_wallets
+    ip_range.is_active = bool(data.get('is_active', True))
+    if ban_hours > 0:
+        ip_range.banned_until = datetime.utcnow() + timedelta(hours=ban_hours)
+    elif 'ban_hours' in data:
+        ip_range.banned_until = None
+    
+    stamp_range_changes([ip_range])
+    db.session.commit()
+    ip_ranges.apply([ip_range])
+    
+    return jsonify({
+        'success': True,
+        'message': f'Range {cidr} saved',
+        'range': ip_range.to_dict()
+    })
+
+# ==================== EXISTING AIRDROP ENDPOINTS ====================
+
+@app.route('/')
+def index():
+    return render_template('index.html')
+
+@app.before_request
+def check_ip_restriction():
+    if request.endpoint in ['check_wallet', 'claim_airdrop']:
+        ip_address = get_remote_address()
+        
+        wallet_address = None
+        if request.is_json:
+            data = request.get_json(silent=True) or {}
+            wallet_address = data.get('wallet_address', '').strip().lower()
+        
+        if wallet_address == ADMIN_WALLET.lower():
+            return
         
-        if restriction:
-            if restriction.banned_until and datetime.utcnow() < restriction.banned_until:
+        banned_range = ip_ranges.banned_range(ip_address)
+        if banned_range:
+            return jsonify({
+                'success': False,
+                'message': f'IP range temporarily restricted. Try again after {banned_range["banned_until"].strftime("%Y-%m-%d %H:%M UTC")}'
+            }), 429
+        
+        restriction = get_ip_restriction(ip_address)
+        
+        if restriction is not NO_IP_RESTRICTION:
+            if restriction['banned_until'] and datetime.utcnow() < restriction['banned_until']:
                 return jsonify({
                     'success': False,
-                    'message': f'IP temporarily restricted. Try again after {restriction.banned_until.strftime("%Y-%m-%d %H:%M UTC")}'
+                    'message': f'IP temporarily restricted. Try again after {restriction["banned_until"].strftime("%Y-%m-%d %H:%M UTC")}'
                 }), 429
             
-            if restriction.wallet_count >= MAX_WALLETS_PER_IP:
-                restriction.banned_until = datetime.utcnow() + timedelta(hours=IP_BAN_HOURS)
-                db.session.commit()
+            if restriction['wallet_count'] >= MAX_WALLETS_PER_IP:
+                ban_ip(ip_address, datetime.utcnow() + timedelta(hours=IP_BAN_HOURS))
                 return jsonify({
                     'success': False,
                     'message': f'Maximum wallet limit ({MAX_WALLETS_PER_IP}) reached from this IP address. Temporary restriction applied.'
@@ -1934,7 +4098,8 @@ def after_request(response):
     return response
 
 @app.route('/api/check-wallet', methods=['POST'])
-@limiter.limit("10 per minute")
+@limiter.limit("10 per minute", key_func=get_wallet_and_address)
+@limiter.limit("120 per minute")
 def check_wallet():
     data = request.json or {}
     wallet_address = data.get('wallet_address', '').strip()
@@ -1951,34 +4116,17 @@ def check_wallet():
     
     ip_address = get_remote_address()
     
-    claim = AirdropClaim.query.filter_by(wallet=wallet_address).first()
+    claim = AirdropClaim.query.filter_by(wallet=wallet_address, reward_type='airdrop').first()
     
     if claim:
         user = User.query.get(wallet_address)
-        current_referral_count = user.referral_count if user else 0
-        
-        achievement_rewards = calculate_achievement_rewards(wallet_address)
-        
-        total_amount = AirdropSystem.calculate_airdrop_amount(
-            current_referral_count, 
-            float(achievement_rewards)
-        )
         
         return jsonify({
             'success': True,
             'eligible': False,
             'message': 'Wallet has already claimed tokens',
             'already_claimed': True,
-            'claim_data': {
-                'amount': total_amount,
-                'base_amount': 1005.0,
-                'referral_bonus': current_referral_count * 121,
-                'achievement_rewards': float(achievement_rewards),
-                'referral_count': current_referral_count,
-                'tx_hash': claim.tx_hash,
-                'timestamp': claim.claimed_at.isoformat(),
-                'referrer': claim.referrer
-            },
+            'claim_data': build_claim_data(user, claim, calculate_achievement_rewards(wallet_address)),
             'referral_code': user.referral_code if user else None,
             'can_still_refer': True
         })
@@ -1991,8 +4139,7 @@ def check_wallet():
         reasons.append("Invalid wallet format")
     
     if is_eligible:
-        restriction = IPRestriction.query.filter_by(ip_address=ip_address).first()
-        if restriction and restriction.wallet_count >= MAX_WALLETS_PER_IP:
+        if get_ip_restriction(ip_address)['wallet_count'] >= MAX_WALLETS_PER_IP:
             is_eligible = False
             reasons.append(f"Maximum wallets ({MAX_WALLETS_PER_IP}) reached from this IP")
     
@@ -2016,29 +4163,14 @@ def check_wallet():
             )
             db.session.add(user)
             
-            restriction = IPRestriction.query.filter_by(ip_address=ip_address).first()
-            if restriction:
-                restriction.wallet_count += 1
-                restriction.last_wallet_created = datetime.utcnow()
-            else:
-                restriction = IPRestriction(
-                    ip_address=ip_address,
-                    wallet_count=1,
-                    last_wallet_created=datetime.utcnow()
-                )
-                db.session.add(restriction)
+            restriction = count_wallet_for_ip(ip_address)
+            banned_ranges = count_wallet_for_ranges(ip_address)
             
-            notification = Notification(
-                id=AirdropSystem.generate_notification_id(),
-                wallet=wallet_address,
-                type='welcome',
-                message='Welcome to APRO Airdrop! Claim your first tokens.',
-                timestamp=datetime.utcnow(),
-                read=False
-            )
-            db.session.add(notification)
+            notification_writer.stage(wallet_address, 'welcome', 'Welcome to APRO Airdrop! Claim your first tokens.')
             
             db.session.commit()
+            cache_ip_restriction(ip_address, restriction)
+            ip_ranges.apply(banned_ranges)
         else:
             referral_code = user.referral_code
             user.last_active = datetime.utcnow()
@@ -2053,8 +4185,72 @@ def check_wallet():
         'user_exists': user_exists
     })
 
+def build_existing_claim_response(wallet_address, existing_claim):
+    user = User.query.get(wallet_address)
+    current_referral_count = user.referral_count if user else 0
+    
+    achievement_rewards = calculate_achievement_rewards(wallet_address)
+    
+    total_amount = AirdropSystem.calculate_airdrop_amount(
+        current_referral_count,
+        float(achievement_rewards)
+    )
+    
+    claim_data = {
+        'amount': total_amount,
+        'base_amount': 1005.0,
+        'referral_bonus': current_referral_count * 121,
+        'achievement_rewards': float(achievement_rewards),
+        'referral_count': current_referral_count,
+        'tx_hash': existing_claim.tx_hash,
+        'timestamp': existing_claim.claimed_at.isoformat()
+    }
+    
+    return jsonify({
+        'success': True,
+        'message': 'Airdrop already claimed',
+        'already_claimed': True,
+        'data': claim_data
+    })
+
+def credit_referrer(referral_code, referee_wallet):
+    """Credit the code's owner for referee_wallet's claim; returns their wallet or None.
+    
+    Inline mode counts the referral right here. Deferred mode only resolves
+    the code and appends a referral_events row, leaving the referrer's row
+    (and its lock) to referral_aggregator.
+    """
+    if REFERRAL_COUNTER_MODE != 'deferred':
+        return increment_referral_counters(
+            and_(User.referral_code == referral_code, User.wallet != referee_wallet)
+        )
+    
+    referrer_wallet = db.session.query(User.wallet).filter(
+        User.referral_code == referral_code, User.wallet != referee_wallet
+    ).scalar()
+    if referrer_wallet:
+        db.session.add(ReferralEvent(referrer=referrer_wallet, referee=referee_wallet))
+    return referrer_wallet
+
+def insert_airdrop_claim(values):
+    """INSERT ... ON CONFLICT DO NOTHING RETURNING for the wallet's airdrop; False if one already exists.
+    
+    A Core insert skips the after_flush hooks, so the balance and row count are applied here.
+    """
+    insert = postgresql_insert if is_postgresql() else sqlite_insert
+    table = AirdropClaim.__table__
+    stmt = insert(table).values(reward_type='airdrop', status='completed', **values)
+    inserted = db.session.execute(stmt.on_conflict_do_nothing().returning(table.c.id)).first()
+    if not inserted:
+        return False
+    
+    credit_wallet_balances({values['wallet']: values['amount']}, db.session())
+    count_core_inserts(db.session.connection(), 'airdrop_claims', 1)
+    return True
+
 @app.route('/api/claim-airdrop', methods=['POST'])
-@limiter.limit("5 per minute")
+@limiter.limit("5 per minute", key_func=get_wallet_and_address)
+@limiter.limit("60 per minute")
 def claim_airdrop():
     data = request.json or {}
     wallet_address = data.get('wallet_address', '').strip()
@@ -2069,131 +4265,90 @@ def claim_airdrop():
     
     wallet_address = wallet_or_error
     
-    existing_claim = AirdropClaim.query.filter_by(wallet=wallet_address).first()
+    existing_claim = AirdropClaim.query.filter_by(wallet=wallet_address, reward_type='airdrop').first()
     if existing_claim:
+        return build_existing_claim_response(wallet_address, existing_claim)
+    
+    # Everything below is one transaction; a concurrent claim for the same
+    # wallet makes the claim insert (or the new user row) conflict, and the
+    # whole transaction is rolled back, referrer credit included
+    try:
         user = User.query.get(wallet_address)
-        current_referral_count = user.referral_count if user else 0
+        
+        referrer_wallet = None
+        if referral_code_used:
+            referrer_wallet = credit_referrer(referral_code_used, wallet_address)
+        
+        if not user:
+            referral_code = AirdropSystem.generate_referral_code(wallet_address)
+            user = User(
+                wallet=wallet_address,
+                referral_code=referral_code,
+                referral_count=0,
+                link_clicks=0,
+                link_conversions=0,
+                referrer=referrer_wallet,
+                active=False,
+                ip_address=get_remote_address(),
+                last_active=datetime.utcnow()
+            )
+            db.session.add(user)
+        elif referrer_wallet:
+            user.referrer = referrer_wallet
+        
+        base_amount = 1005.0
+        referral_count = user.referral_count
         
         achievement_rewards = calculate_achievement_rewards(wallet_address)
         
         total_amount = AirdropSystem.calculate_airdrop_amount(
-            current_referral_count,
+            referral_count,
             float(achievement_rewards)
         )
         
-        claim_data = {
+        claim_values = {
+            'wallet': wallet_address,
             'amount': total_amount,
-            'base_amount': 1005.0,
-            'referral_bonus': current_referral_count * 121,
+            'base_amount': base_amount,
+            'referral_bonus': referral_count * 121,
             'achievement_rewards': float(achievement_rewards),
-            'referral_count': current_referral_count,
-            'tx_hash': existing_claim.tx_hash,
-            'timestamp': existing_claim.claimed_at.isoformat()
+            'referral_count': referral_count,
+            'referrer': referrer_wallet,
+            'tx_hash': AirdropSystem.generate_tx_hash(),
+            'claimed_at': datetime.utcnow()
         }
+        if not insert_airdrop_claim(claim_values):
+            db.session.rollback()
+            existing_claim = AirdropClaim.query.filter_by(wallet=wallet_address, reward_type='airdrop').first()
+            return build_existing_claim_response(wallet_address, existing_claim)
         
-        return jsonify({
-            'success': True,
-            'message': 'Airdrop already claimed',
-            'already_claimed': True,
-            'data': claim_data
-        })
-    
-    user = User.query.get(wallet_address)
-    if not user:
-        referral_code = AirdropSystem.generate_referral_code(wallet_address)
-        user = User(
-            wallet=wallet_address,
-            referral_code=referral_code,
-            referral_count=0,
-            link_clicks=0,
-            link_conversions=0,
-            referrer=None,
-            active=False,
-            ip_address=get_remote_address(),
-            last_active=datetime.utcnow()
-        )
-        db.session.add(user)
-    
-    referrer_wallet = None
-    if referral_code_used:
-        referrer = User.query.filter_by(referral_code=referral_code_used).first()
-        if referrer and referrer.wallet != wallet_address:
-            referrer_wallet = referrer.wallet
-            
-            referrer.referral_count += 1
-            referrer.link_conversions += 1
-            
-            if referrer.referral_count >= 2:
-                referrer.active = True
-            
-            referral = Referral(
+        if referrer_wallet:
+            db.session.add(Referral(
                 id=AirdropSystem.generate_referral_id(referrer_wallet, wallet_address),
                 referrer=referrer_wallet,
                 referee=wallet_address,
                 code_used=referral_code_used,
                 timestamp=datetime.utcnow()
-            )
-            db.session.add(referral)
+            ))
             
-            user.referrer = referrer_wallet
-            
-            check_and_award_achievements(referrer_wallet)
+            if REFERRAL_COUNTER_MODE != 'deferred':
+                record_referral_in_network(referrer_wallet, wallet_address)
+                achievement_engine.on_event(referrer_wallet, 'referral')
             
-            notification = Notification(
-                id=AirdropSystem.generate_notification_id(),
-                wallet=referrer_wallet,
-                type='referral',
-                message=f'🎉 New referral! {wallet_address[:6]}... claimed using your code',
-                timestamp=datetime.utcnow(),
-                read=False
-            )
-            db.session.add(notification)
-    
-    base_amount = 1005.0
-    referral_count = user.referral_count
-    
-    achievement_rewards = calculate_achievement_rewards(wallet_address)
-    
-    total_amount = AirdropSystem.calculate_airdrop_amount(
-        referral_count,
-        float(achievement_rewards)
-    )
-    
-    claim = AirdropClaim(
-        wallet=wallet_address,
-        amount=total_amount,
-        base_amount=base_amount,
-        referral_bonus=referral_count * 121,
-        achievement_rewards=float(achievement_rewards),
-        referral_count=referral_count,
-        referrer=referrer_wallet,
-        tx_hash=AirdropSystem.generate_tx_hash(),
-        claimed_at=datetime.utcnow(),
-        status='completed'
-    )
-    db.session.add(claim)
-    
-    if Achievement.query.filter_by(wallet=wallet_address, achievement_id='first_claim').first() is None:
-        achievement = Achievement(
-            wallet=wallet_address,
-            achievement_id='first_claim'
-        )
-        db.session.add(achievement)
-        achievement_rewards += 1
-    
-    notification = Notification(
-        id=AirdropSystem.generate_notification_id(),
-        wallet=wallet_address,
-        type='claim',
-        message=f'✅ Successfully claimed {total_amount} APRO tokens!',
-        timestamp=datetime.utcnow(),
-        read=False
-    )
-    db.session.add(notification)
-    
-    db.session.commit()
-    
-    check_and_award_achievements(wallet_address)
+            notification_writer.stage(referrer_wallet, 'referral', f'🎉 New referral! {wallet_address[:6]}... claimed using your code')
+        
+        awarded = achievement_engine.on_event(wallet_address, 'claim')
+        achievement_rewards += sum(rule['reward'] for rule in awarded)
+        
+        notification_writer.stage(wallet_address, 'claim', f'✅ Successfully claimed {total_amount} APRO tokens!')
+        
+        db.session.commit()
+    except IntegrityError:
+        db.session.rollback()
+        existing_claim = AirdropClaim.query.filter_by(wallet=wallet_address, reward_type='airdrop').first()
+        if not existing_claim:
+            raise
+        return build_existing_claim_response(wallet_address, existing_claim)
     
     return jsonify({
         'success': True,
@@ -2204,43 +4359,129 @@ def claim_airdrop():
             'referral_bonus': referral_count * 121,
             'achievement_rewards': float(achievement_rewards),
             'referral_count': referral_count,
-            'tx_hash': claim.tx_hash,
-            'timestamp': claim.claimed_at.isoformat()
+            'tx_hash': claim_values['tx_hash'],
+            'timestamp': claim_values['claimed_at'].isoformat()
         },
         'referral_code': user.referral_code
     })
 
-@app.route('/api/leaderboard', methods=['GET'])
-def get_leaderboard():
-    try:
-        users = User.query.order_by(
-            User.referral_count.desc(),
-            User.created_at.asc()
-        ).limit(20).all()
+# ==================== LEADERBOARD ====================
+
+LEADERBOARD_SIZE = 20
+
+def build_leaderboard_entry(user, achievement_rewards, claim):
+    if claim:
+        total_tokens = claim.amount
+    else:
+        total_tokens = 1005.0 + (user.referral_count * 121) + float(achievement_rewards)
+    
+    return {
+        'wallet': user.wallet,
+        'display_wallet': f"{user.wallet[:6]}...{user.wallet[-4:]}",
+        'referral_count': user.referral_count,
+        'referral_bonus': user.referral_count * 121,
+        'achievement_rewards': float(achievement_rewards),
+        'total_tokens': total_tokens,
+        'is_active': user.active,
+        'claimed': claim is not None
+    }
+
+def build_leaderboard_current_user(user, achievement_rewards, claim):
+    entry = build_leaderboard_entry(user, achievement_rewards, claim)
+    entry['rank'] = get_leaderboard_rank(user)
+    return entry
+
+class LeaderboardSnapshot:
+    """Shared leaderboard payload, rebuilt at most once per refresh interval.
+    
+    The first request builds the snapshot inline. After that, a request that
+    finds it stale starts a background rebuild and is served the previous
+    snapshot, so no request waits on the leaderboard queries.
+    """
+    
+    def __init__(self, refresh_seconds):
+        self.refresh_seconds = refresh_seconds
+        self._lock = threading.Lock()
+        self._payload = None
+        self._etag = None
+        self._built_at = 0.0
+        self._refreshing = False
+    
+    def get(self):
+        if self._payload is None:
+            with self._lock:
+                if self._payload is None:
+                    self._rebuild()
+        elif time.monotonic() - self._built_at >= self.refresh_seconds:
+            with self._lock:
+                start_refresh = not self._refreshing
+                self._refreshing = True
+            if start_refresh:
+                threading.Thread(target=self._refresh_in_background, daemon=True).start()
+        
+        return self._payload, self._etag
+    
+    def _refresh_in_background(self):
+        try:
+            with app.app_context():
+                self._rebuild()
+        except Exception as e:
+            print(f"⚠️  Leaderboard refresh failed: {e}")
+        finally:
+            self._refreshing = False
+    
+    def _rebuild(self):
+        users = User.query.order_by(*LEADERBOARD_ORDER).limit(LEADERBOARD_SIZE).all()
+        wallets = [user.wallet for user in users]
+        
+        rewards_by_id = {a['id']: a['reward'] for a in ACHIEVEMENTS}
+        achievement_rewards = dict.fromkeys(wallets, 0)
+        for wallet, achievement_id in db.session.query(
+            Achievement.wallet, Achievement.achievement_id
+        ).filter(Achievement.wallet.in_(wallets)):
+            achievement_rewards[wallet] += rewards_by_id.get(achievement_id, 0)
+        
+        claims = {}
+        for claim in AirdropClaim.query.filter(
+            AirdropClaim.wallet.in_(wallets),
+            AirdropClaim.reward_type == 'airdrop'
+        ).order_by(AirdropClaim.id.asc()):
+            claims.setdefault(claim.wallet, claim)
         
         top_referrers = []
-        for user in users:
-            achievement_rewards = calculate_achievement_rewards(user.wallet)
-            
-            claim = AirdropClaim.query.filter_by(wallet=user.wallet).first()
-            if claim:
-                total_tokens = claim.amount
-            else:
-                total_tokens = 1005.0 + (user.referral_count * 121) + float(achievement_rewards)
-            
-            top_referrers.append({
-                'wallet': user.wallet,
-                'display_wallet': f"{user.wallet[:6]}...{user.wallet[-4:]}",
-                'referral_count': user.referral_count,
-                'referral_bonus': user.referral_count * 121,
-                'achievement_rewards': float(achievement_rewards),
-                'total_tokens': total_tokens,
-                'is_active': user.active,
-                'claimed': claim is not None
-            })
+        for rank, user in enumerate(users, start=1):
+            entry = build_leaderboard_entry(user, achievement_rewards[user.wallet], claims.get(user.wallet))
+            entry['rank'] = rank
+            top_referrers.append(entry)
+        
+        stats = get_global_stats()
+        total_participants = stats['users']
+        total_referrals = stats['referrals']
+        total_claims = stats['airdrop_claims']
+        active_referrers = stats['active_referrers']
         
-        for i, ref in enumerate(top_referrers):
-            ref['rank'] = i + 1
+        avg_referrals = total_referrals / max(total_participants, 1)
+        
+        payload = {
+            'top_referrers': top_referrers,
+            'total_participants': total_participants,
+            'total_claims': total_claims,
+            'total_referrals': total_referrals,
+            'active_referrers': active_referrers,
+            'avg_referrals': round(avg_referrals, 2),
+            'last_updated': datetime.utcnow().isoformat()
+        }
+        
+        self._payload = payload
+        self._etag = hashlib.md5(json.dumps(payload, sort_keys=True).encode()).hexdigest()
+        self._built_at = time.monotonic()
+
+leaderboard_snapshot = LeaderboardSnapshot(LEADERBOARD_REFRESH_SECONDS)
+
+@app.route('/api/leaderboard', methods=['GET'])
+def get_leaderboard():
+    try:
+        snapshot, etag = leaderboard_snapshot.get()
         
         current_wallet = request.args.get('wallet', '').strip().lower()
         current_user_rank = None
@@ -2248,58 +4489,24 @@ def get_leaderboard():
         if current_wallet:
             current_user = User.query.get(current_wallet)
             if current_user:
-                all_users = User.query.order_by(
-                    User.referral_count.desc(),
-                    User.created_at.asc()
-                ).all()
-                
-                user_rank = 1
-                for user in all_users:
-                    if user.wallet == current_wallet:
-                        break
-                    user_rank += 1
-                
-                achievement_rewards = calculate_achievement_rewards(current_wallet)
-                
-                claim = AirdropClaim.query.filter_by(wallet=current_wallet).first()
-                if claim:
-                    total_tokens = claim.amount
-                else:
-                    total_tokens = 1005.0 + (current_user.referral_count * 121) + float(achievement_rewards)
+                current_user_rank = build_leaderboard_current_user(
+                    current_user,
+                    calculate_achievement_rewards(current_wallet),
+                    AirdropClaim.query.filter_by(wallet=current_wallet, reward_type='airdrop').first()
+                )
                 
-                current_user_rank = {
-                    'wallet': current_wallet,
-                    'display_wallet': f"{current_wallet[:6]}...{current_wallet[-4:]}",
-                    'referral_count': current_user.referral_count,
-                    'referral_bonus': current_user.referral_count * 121,
-                    'achievement_rewards': float(achievement_rewards),
-                    'total_tokens': total_tokens,
-                    'rank': user_rank,
-                    'is_active': current_user.active,
-                    'claimed': claim is not None
-                }
+                # The per-wallet part is layered on top, so it has to be part of the ETag
+                etag = hashlib.md5(
+                    (etag + json.dumps(current_user_rank, sort_keys=True)).encode()
+                ).hexdigest()
         
-        total_participants = User.query.count()
-        total_referrals = Referral.query.count()
-        total_claims = AirdropClaim.query.count()
-        
-        active_referrers = User.query.filter(User.referral_count > 0).count()
-        
-        avg_referrals = total_referrals / max(total_participants, 1)
-        
-        return jsonify({
+        response = jsonify({
             'success': True,
-            'data': {
-                'top_referrers': top_referrers,
-                'current_user': current_user_rank,
-                'total_participants': total_participants,
-                'total_claims': total_claims,
-                'total_referrals': total_referrals,
-                'active_referrers': active_referrers,
-                'avg_referrals': round(avg_referrals, 2),
-                'last_updated': datetime.utcnow().isoformat()
-            }
+            'data': dict(snapshot, current_user=current_user_rank)
         })
+        response.set_etag(etag)
+        response.cache_control.no_cache = True
+        return response.make_conditional(request)
     
     except Exception as e:
         return jsonify({
@@ -2307,6 +4514,212 @@ def get_leaderboard():
             'message': f'Error generating leaderboard: {str(e)}'
         })
 
+# ==================== DASHBOARD ====================
+
+DASHBOARD_SECTIONS = ('claim', 'referral_stats', 'achievements', 'network', 'withdrawal', 'tasks', 'leaderboard')
+
+@app.route('/api/dashboard', methods=['GET'])
+def get_dashboard():
+    """Everything the wallet view needs in one response; ?fields= picks sections"""
+    wallet_address = request.args.get('wallet', '').strip().lower()
+    
+    if not wallet_address:
+        return jsonify({
+            'success': False,
+            'message': 'Wallet address is required'
+        })
+    
+    fields = [f.strip() for f in request.args.get('fields', '').split(',') if f.strip()]
+    fields = fields or list(DASHBOARD_SECTIONS)
+    unknown_fields = [f for f in fields if f not in DASHBOARD_SECTIONS]
+    if unknown_fields:
+        return jsonify({
+            'success': False,
+            'message': f"Unknown fields: {', '.join(unknown_fields)}. Valid fields: {', '.join(DASHBOARD_SECTIONS)}"
+        })
+    
+    user = User.query.get(wallet_address)
+    if not user:
+        return jsonify({
+            'success': False,
+            'message': 'User not found'
+        })
+    
+    # Rows shared between sections are loaded once, and only if a section needs them
+    unlocked_ids = set()
+    if {'claim', 'achievements', 'network', 'leaderboard'} & set(fields):
+        unlocked_ids = get_unlocked_achievement_ids(wallet_address)
+    achievement_rewards = sum_achievement_rewards(unlocked_ids)
+    
+    claim = None
+    if {'claim', 'leaderboard'} & set(fields):
+        claim = AirdropClaim.query.filter_by(wallet=wallet_address, reward_type='airdrop').first()
+    
+    data = {}
+    if 'claim' in fields:
+        data['claim'] = build_claim_data(user, claim, achievement_rewards) if claim else None
+    if 'referral_stats' in fields:
+        data['referral_stats'] = build_referral_stats(user)
+    if 'achievements' in fields:
+        data['achievements'] = build_achievements_data(user, unlocked_ids)
+    if 'network' in fields:
+        try:
+            depth = int(request.args.get('depth', NETWORK_DEFAULT_DEPTH))
+        except ValueError:
+            depth = NETWORK_DEFAULT_DEPTH
+        data['network'] = build_network_analysis(user, achievement_rewards, depth)
+    if 'withdrawal' in fields:
+        data['withdrawal'] = build_withdrawal_status(user)
+    if 'tasks' in fields:
+        data['tasks'] = build_tasks_data(wallet_address)
+    if 'leaderboard' in fields:
+        snapshot, _ = leaderboard_snapshot.get()
+        data['leaderboard'] = dict(
+            snapshot,
+            current_user=build_leaderboard_current_user(user, achievement_rewards, claim)
+        )
+    
+    return jsonify({
+        'success': True,
+        'wallet': wallet_address,
+        'data': data
+    })
+
+# ==================== BATCH REQUESTS ====================
+
+MAX_BATCH_REQUESTS = 10
+
+def dispatch_sub_request(method, path, body):
+    """Run one API call in-process, inside the current app context and DB session"""
+    builder = EnvironBuilder(
+        path=path,
+        method=method,
+        json=body if method != 'GET' else None,
+        environ_base={'REMOTE_ADDR': request.environ.get('REMOTE_ADDR')},
+        headers={'User-Agent': request.headers.get('User-Agent', '')}
+    )
+    try:
+        environ = builder.get_environ()
+    finally:
+        builder.close()
+    
+    # Same app, so the pushed request reuses the outer app context and
+    # db.session; before_request hooks (rate limits, IP checks) still run
+    with app.request_context(environ):
+        try:
+            response = app.full_dispatch_request()
+        except Exception as e:
+            db.session.rollback()
+            return 500, {'success': False, 'error': str(e)}
+    
+    if response.mimetype == 'text/event-stream':
+        response.close()
+        return 400, {'success': False, 'error': 'Streaming endpoints cannot be batched'}
+    
+    body = response.get_json(silent=True)
+    return response.status_code, body if body is not None else response.get_data(as_text=True)
+
+@app.route('/api/batch', methods=['POST'])
+@limiter.limit("20 per minute")
+def batch_requests():
+    """Execute several API calls in one HTTP request.
+    
+    Body: {"requests": [{"method": "GET", "path": "/api/...", "body": {...}}, ...]}
+    Sub-requests run in order and each gets its own rate limit checks.
+    """
+    data = request.json or {}
+    sub_requests = data.get('requests')
+    
+    if not isinstance(sub_requests, list) or not sub_requests:
+        return jsonify({
+            'success': False,
+            'message': 'A non-empty list of requests is required'
+        }), 400
+    
+    if len(sub_requests) > MAX_BATCH_REQUESTS:
+        return jsonify({
+            'success': False,
+            'message': f'At most {MAX_BATCH_REQUESTS} requests per batch'
+        }), 400
+    
+    responses = []
+    for sub_request in sub_requests:
+        if not isinstance(sub_request, dict):
+            sub_request = {}
+        method = str(sub_request.get('method', 'GET')).upper()
+        path = str(sub_request.get('path', ''))
+        
+        if method not in ('GET', 'POST') or not path.startswith('/api/') or path.split('?')[0] == '/api/batch':
+            status, body = 400, {'success': False, 'error': 'Only GET/POST to /api/ endpoints can be batched'}
+        else:
+            status, body = dispatch_sub_request(method, path, sub_request.get('body'))
+        
+        responses.append({
+            'method': method,
+            'path': path,
+            'status': status,
+            'body': body
+        })
+    
+    return jsonify({
+        'success': True,
+        'responses': responses
+    })
+
+# ==================== LIVE EVENTS ====================
+
+# gunicorn worker classes that serve each request on a greenlet
+ASYNC_WORKER_CLASSES = ('GeventWorker', 'GeventPyWSGIWorker')
+async_worker = False
+
+def note_worker_class(worker):
+    """Record the worker class gunicorn actually runs (called from post_fork)"""
+    global async_worker
+    async_worker = type(worker).__name__ in ASYNC_WORKER_CLASSES
+
+def live_events_streaming():
+    if LIVE_EVENTS_STREAMING == 'auto':
+        return async_worker
+    return LIVE_EVENTS_STREAMING == 'on'
+
+def format_sse(event_name, data):
+    return f"event: {event_name}\ndata: {json.dumps(data)}\n\n"
+
+@app.route('/api/events', methods=['GET'])
+def stream_events():
+    """Server-Sent Events for one wallet: notification, balance and streak"""
+    wallet_address = request.args.get('wallet', '').strip().lower()
+    
+    is_valid, wallet_or_error = AirdropSystem.validate_wallet_address(wallet_address)
+    if not is_valid:
+        return jsonify({'success': False, 'message': wallet_or_error}), 400
+    
+    if not live_events_streaming():
+        # 204 tells EventSource not to reconnect; the page falls back to polling
+        return '', 204
+    
+    subscriber = event_broker.subscribe(wallet_or_error)
+    
+    def generate():
+        # Streams are capped so sync workers are handed back; EventSource reconnects on its own
+        deadline = time.time() + SSE_MAX_SECONDS
+        try:
+            yield "retry: 3000\n\n"
+            while time.time() < deadline:
+                try:
+                    event_name, data = subscriber.get(timeout=SSE_KEEPALIVE_SECONDS)
+                except queue.Empty:
+                    yield ": keepalive\n\n"
+                    continue
+                yield format_sse(event_name, data)
+        finally:
+            event_broker.unsubscribe(wallet_or_error, subscriber)
+    
+    response = Response(stream_with_context(generate()), mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
+
 # ==================== HEALTH CHECK ====================
 
 @app.route('/api/health', methods=['GET'])
@@ -2428,10 +4841,107 @@ def admin_presale_dashboard():
     except Exception as e:
         return f"Error: {str(e)}", 500
 
+# ==================== ACHIEVEMENT BACKFILL ====================
+
+def backfill_achievement(rule, unlocked_at):
+    """Award one rule to every wallet that qualifies in a single INSERT ... SELECT.
+    
+    Returns the wallets that were newly awarded; the caller commits.
+    """
+    wallets = aliased(User)
+    qualifying = select(
+        wallets.wallet,
+        literal(rule['id'], String(50)),
+        literal(unlocked_at, DateTime)
+    ).where(
+        ACHIEVEMENT_METRICS[rule['metric']](wallets.wallet) >= rule['threshold'],
+        ~select(Achievement.id).where(
+            Achievement.wallet == wallets.wallet,
+            Achievement.achievement_id == rule['id']
+        ).exists()
+    )
+    
+    insert = postgresql_insert if is_postgresql() else sqlite_insert
+    stmt = insert(Achievement.__table__).from_select(
+        ['wallet', 'achievement_id', 'unlocked_at'], qualifying
+    ).on_conflict_do_nothing(
+        index_elements=['wallet', 'achievement_id']
+    ).returning(Achievement.__table__.c.wallet)
+    
+    awarded = db.session.execute(stmt).scalars().all()
+    count_core_inserts(db.session.connection(), 'achievements', len(awarded))
+    return awarded
+
+def insert_achievement_notifications(rule, wallets, timestamp):
+    message = f'🏆 Achievement unlocked: {rule["name"]}! +{rule["reward"]} APRO'
+    connection = db.session.connection()
+    for i in range(0, len(wallets), NOTIFICATION_BATCH_SIZE):
+        insert_notification_rows(connection, [
+            build_notification_row(wallet, 'achievement', message, timestamp)
+            for wallet in wallets[i:i + NOTIFICATION_BATCH_SIZE]
+        ])
+
+@app.cli.command('backfill-achievements')
+@click.option('--achievement', 'achievement_ids', multiple=True, help='Only backfill these achievement ids')
+def backfill_achievements_command(achievement_ids):
+    """Award ACHIEVEMENTS to every wallet that already qualifies"""
+    rules = [a for a in ACHIEVEMENTS if not achievement_ids or a['id'] in achievement_ids]
+    unknown = set(achievement_ids) - {a['id'] for a in rules}
+    if unknown:
+        raise click.BadParameter(f"Unknown achievements: {', '.join(sorted(unknown))}")
+    
+    for rule in rules:
+        started = time.time()
+        now = datetime.utcnow()
+        wallets = backfill_achievement(rule, now)
+        insert_achievement_notifications(rule, wallets, now)
+        db.session.commit()
+        print(f"✅ {rule['id']}: awarded to {len(wallets)} wallets in {time.time() - started:.2f}s")
+
 # ==================== INITIALIZE DATABASE SAFELY ====================
 
-def initialize_database_safely():
-    """Initialize database with error handling"""
+SCHEMA_VERSION_KEY = 'schema_version'
+
+def schema_version():
+    """Short hash of the declared tables, columns and indexes plus the seed data.
+    
+    Any model change or new TASKS entry changes it, so a stamp that matches
+    means init_database() has nothing to do.
+    """
+    parts = [ADMIN_WALLET.lower()] + sorted(t['id'] for t in TASKS)
+    for table in db.metadata.sorted_tables:
+        parts.append(table.name)
+        parts.extend(f'{column.name}:{column.type}' for column in table.columns)
+        parts.extend(sorted(str(index.name) for index in table.indexes))
+    return hashlib.sha1('|'.join(parts).encode()).hexdigest()[:12]
+
+def seed_tasks():
+    """Insert every missing TASKS row in one statement; rows already present keep their admin edits"""
+    now = datetime.utcnow()
+    rows = [{
+        'id': task_def['id'],
+        'title': task_def['title'],
+        'description': task_def['description'],
+        'category': task_def['category'],
+        'type': task_def['type'],
+        'reward_apro': task_def['reward_apro'],
+        'max_completions': task_def.get('max_completions', 1),
+        'is_active': task_def.get('is_active', True),
+        'requires_verification': task_def.get('requires_verification', False),
+        'verification_type': task_def.get('verification_type'),
+        'created_at': now,
+        'updated_at': now
+    } for task_def in TASKS]
+    
+    insert = postgresql_insert if is_postgresql() else sqlite_insert
+    table = Task.__table__
+    stmt = insert(table).values(rows).on_conflict_do_nothing(index_elements=['id']).returning(table.c.id)
+    added = len(db.session.execute(stmt).all())
+    count_core_inserts(db.session.connection(), 'tasks', added)
+    return added
+
+def init_database():
+    """Create and upgrade tables, build derived tables, seed data and stamp the schema version"""
     print("=" * 60)
     print("Initializing APRO Token Database...")
     print("=" * 60)
@@ -2447,6 +4957,29 @@ def initialize_database_safely():
                 print(f"⚠️  Database tables may already exist: {e}")
                 print("Continuing with existing database structure...")
             
+            print("🔄 Upgrading database schema...")
+            upgrade_schema()
+            
+            if GlobalStat.query.first() is None:
+                print("🔄 Building global counters...")
+                rebuild_global_stats()
+                print("✅ Global counters built")
+            
+            if ReferralNetwork.query.first() is None and Referral.query.first() is not None:
+                print("🔄 Building referral network cache...")
+                rebuild_referral_networks()
+                print("✅ Referral network cache built")
+            
+            if WalletBalance.query.first() is None and AirdropClaim.query.filter_by(status='completed').first() is not None:
+                print("🔄 Building wallet balances...")
+                rebuild_wallet_balances()
+                print("✅ Wallet balances built")
+            
+            if NotificationCounter.query.first() is None and Notification.query.filter_by(read=False).first() is not None:
+                print("🔄 Building unread notification counters...")
+                rebuild_notification_counters()
+                print("✅ Unread notification counters built")
+            
             # Initialize admin user
             print("🔄 Checking admin user...")
             admin_user = User.query.get(ADMIN_WALLET.lower())
@@ -2489,48 +5022,82 @@ def initialize_database_safely():
             
             # Initialize tasks
             print("🔄 Initializing tasks...")
-            tasks_added = 0
-            for task_def in TASKS:
-                try:
-                    existing_task = Task.query.get(task_def['id'])
-                    if not existing_task:
-                        task = Task(
-                            id=task_def['id'],
-                            title=task_def['title'],
-                            description=task_def['description'],
-                            category=task_def['category'],
-                            type=task_def['type'],
-                            reward_apro=task_def['reward_apro'],
-                            max_completions=task_def.get('max_completions', 1),
-                            is_active=task_def.get('is_active', True),
-                            requires_verification=task_def.get('requires_verification', False),
-                            verification_type=task_def.get('verification_type'),
-                            created_at=datetime.utcnow(),
-                            updated_at=datetime.utcnow()
-                        )
-                        db.session.add(task)
-                        tasks_added += 1
-                except Exception as e:
-                    print(f"⚠️  Could not add task '{task_def['id']}': {e}")
-                    continue
+            try:
+                tasks_added = seed_tasks()
+                db.session.commit()
+            except Exception as e:
+                db.session.rollback()
+                tasks_added = 0
+                print(f"⚠️  Failed to seed tasks: {e}")
             
             if tasks_added > 0:
-                try:
-                    db.session.commit()
-                    print(f"✅ Added {tasks_added} tasks to database")
-                except Exception as e:
-                    db.session.rollback()
-                    print(f"⚠️  Failed to commit tasks: {e}")
+                print(f"✅ Added {tasks_added} tasks to database")
             else:
                 print("✅ All tasks already exist in database")
             
+            if tasks_added > 0 or get_system_state(TASK_CATALOG_VERSION_KEY) is None:
+                version = task_catalog.bump_version()
+                db.session.commit()
+                task_catalog.reload(str(version))
+                print(f"✅ Task catalog version {version}")
+            
+            version = schema_version()
+            set_system_state(SCHEMA_VERSION_KEY, version)
+            db.session.commit()
+            print(f"✅ Schema version {version} stamped")
+            
             print("=" * 60)
             print("✅ Database initialization completed successfully!")
             print("=" * 60)
+            return True
             
         except Exception as e:
+            db.session.rollback()
             print(f"❌ Database initialization failed: {e}")
             print("Continuing anyway...")
+            return False
+
+def initialize_database_safely():
+    """Import-time check: one system_state read when the schema stamp is current"""
+    if DB_INIT_MODE == 'skip':
+        return
+    
+    with app.app_context():
+        try:
+            stamp = get_system_state(SCHEMA_VERSION_KEY)
+        except Exception:
+            db.session.rollback()
+            stamp = None
+        finally:
+            db.session.remove()
+    
+    expected = schema_version()
+    if stamp == expected:
+        print(f"✅ Database schema {stamp} verified")
+        return
+    
+    if DB_INIT_MODE == 'verify':
+        print(f"❌ Database schema is {stamp or 'not initialized'}, expected {expected}; run `flask init-db`")
+        return
+    
+    init_database()
+
+@app.cli.command('init-db')
+def init_db_command():
+    """Create tables, upgrade the schema, seed the admin user and tasks"""
+    if not init_database():
+        raise click.ClickException('Database initialization failed')
+
+def reset_worker_state(close=False):
+    """Forget pooled connections inherited across fork (gunicorn post_fork with preload_app).
+    
+    close=False leaves the parent's sockets open for the parent; the child
+    opens its own on first use. The writer, broker and limiter storage
+    already restart their threads and connections when they see a new pid.
+    """
+    with app.app_context():
+        db.session.remove()
+        db.engine.dispose(close=close)
 
 # Initialize database
 initialize_database_safely()
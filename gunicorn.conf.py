@@ -0,0 +1,58 @@
+# Gunicorn profile for app:app
+#
+#   gunicorn -c gunicorn.conf.py app:app
+#
+# GUNICORN_WORKER_CLASS picks the worker model:
+#   sync    - one request per process
+#   gthread - GUNICORN_THREADS requests per process
+#   gevent  - GUNICORN_WORKER_CONNECTIONS greenlets per process (default).
+#             Only this mode streams /api/events by default
+#             (LIVE_EVENTS_STREAMING=auto); the others answer it with 204
+# WEB_CONCURRENCY overrides the worker count computed from the CPU count.
+# See "Running in production" in README.md for measured numbers per mode.
+
+import multiprocessing
+import os
+
+worker_class = os.getenv('GUNICORN_WORKER_CLASS', 'gevent')
+
+if worker_class == 'gevent':
+    # Patch before app.py is preloaded so its locks, sockets and threads are
+    # cooperative, and make psycopg2 yield to the hub while waiting on Postgres
+    from gevent import monkey
+    monkey.patch_all()
+    from psycogreen.gevent import patch_psycopg
+    patch_psycopg()
+
+cpu_count = multiprocessing.cpu_count()
+
+bind = f"0.0.0.0:{os.getenv('PORT', '5000')}"
+
+if worker_class == 'sync':
+    workers = int(os.getenv('WEB_CONCURRENCY', cpu_count * 2 + 1))
+    # A sync worker cannot heartbeat while it streams /api/events
+    timeout = int(os.getenv('SSE_MAX_SECONDS', 30)) + 30
+else:
+    workers = int(os.getenv('WEB_CONCURRENCY', cpu_count + 1))
+    timeout = 30
+
+if worker_class == 'gthread':
+    threads = int(os.getenv('GUNICORN_THREADS', 8))
+if worker_class == 'gevent':
+    worker_connections = int(os.getenv('GUNICORN_WORKER_CONNECTIONS', 200))
+
+# Import app.py (and run its schema check) once in the master, then fork
+preload_app = True
+graceful_timeout = 30
+keepalive = 5
+accesslog = '-'
+
+def when_ready(server):
+    # The master never serves requests; close the connection the import opened
+    from app import reset_worker_state
+    reset_worker_state(close=True)
+
+def post_fork(server, worker):
+    from app import note_worker_class, reset_worker_state
+    reset_worker_state()
+    note_worker_class(worker)